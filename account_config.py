@@ -149,6 +149,19 @@ class AccountConfigManager:
         
         return True
     
+    def filter_allowed_symbols(self, account_id: str, symbols) -> set:
+        """Return the subset of symbols allowed for an account, using set operations"""
+        config = self.get_account_config(account_id)
+        if not config:
+            return set()
+        
+        allowed = set(symbols)
+        if config['symbols_allowlist']:
+            allowed.intersection_update(config['symbols_allowlist'])
+        if config['symbols_denylist']:
+            allowed.difference_update(config['symbols_denylist'])
+        return allowed
+    
     def get_accounts_for_strategy(self, strategy_id: str, symbol: str = None) -> List[str]:
         """Get accounts that should receive signals for a specific strategy and symbol"""
         eligible_accounts = []
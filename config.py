@@ -8,6 +8,16 @@ load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///trading_bot.db")
 WEBHOOK_PASSPHRASE = os.getenv("WEBHOOK_PASSPHRASE")
 
+# Connection pool settings shared by every engine (webhook handlers, price monitor and retries all draw from it)
+ENGINE_KWARGS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "25")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "25")),
+    "pool_pre_ping": True,
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    "pool_timeout": 30,
+    "pool_use_lifo": True,  # Reuse the most recently returned connection so warm ones stay in use
+}
+
 # Exchange configuration
 SUPPORTED_EXCHANGES = ["binance", "bybit"]
 
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Request
+import asyncio
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
@@ -6,9 +7,8 @@ import json
 from models import Base, Position, ProcessedEvent
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from config import DATABASE_URL
+from config import DATABASE_URL, ENGINE_KWARGS
 from exchange_manager import exchange_manager
-from position_manager import PositionManager
 
 router = APIRouter()
 
@@ -16,9 +16,8 @@ router = APIRouter()
 templates = Jinja2Templates(directory="templates")
 
 # Database setup
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine)
-position_manager = PositionManager(engine)
+engine = create_engine(DATABASE_URL, **ENGINE_KWARGS)
+SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
 
 # This route is now handled in main.py
 # @router.get("/", response_class=HTMLResponse)
@@ -213,14 +212,23 @@ async def get_symbols():
     return symbols_data
 
 @router.post("/api/sync_positions")
-async def sync_positions():
+async def sync_positions(request: Request):
     """Manually trigger position synchronization with exchange"""
     from sync_positions import sync_positions_with_exchange
+    # Write through the app's single-writer session factory when the app provides one
+    write_session_factory = getattr(request.app.state, "WriteSessionLocal", None)
+    db = write_session_factory() if write_session_factory is not None else None
     try:
-        sync_positions_with_exchange()
+        # Closing rows takes the app's per-position locks, and those and the exchange requests block,
+        # so the sync runs in a worker thread
+        position_manager = getattr(request.app.state, "position_manager", None)
+        await asyncio.to_thread(sync_positions_with_exchange, db, position_manager)
         return {"status": "success", "message": "Position synchronization completed"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
+    finally:
+        if db is not None:
+            db.close()
 
 if __name__ == "__main__":
     import uvicorn
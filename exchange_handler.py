@@ -6,13 +6,37 @@ except ImportError:
     print("❌ Error: binance-connector package not found. Please install it using: pip install binance-connector")
     raise
 from pybit.unified_trading import HTTP
+import requests
+from requests.adapters import HTTPAdapter
 import time
 
 load_dotenv()
 
+# account_id -> exchange client, reused across orders so HTTP keep-alive connections stay warm
+_CLIENT_CACHE = {}
+
 class ExchangeHandler:
+    @staticmethod
+    def configure_session(client):
+        """Mount a larger keep-alive connection pool on the client's underlying requests session."""
+        # binance-connector keeps its session on `.session`, pybit on `.client`
+        session = getattr(client, "session", None) or getattr(client, "client", None)
+        if isinstance(session, requests.Session):
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        return client
+
     @staticmethod
     def get_client(account_id):
+        client = _CLIENT_CACHE.get(account_id)
+        if client is None:
+            client = ExchangeHandler.configure_session(ExchangeHandler._build_client(account_id))
+            _CLIENT_CACHE[account_id] = client
+        return client
+
+    @staticmethod
+    def _build_client(account_id):
         exch_name = os.getenv(f"{account_id}_EXCHANGE", "binance").lower()
         api_key = os.getenv(f"{account_id}_API_KEY")
         api_secret = os.getenv(f"{account_id}_API_SECRET")
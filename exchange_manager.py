@@ -10,12 +10,24 @@ except ImportError:
     print("❌ Error: binance-connector package not found. Please install it using: pip install binance-connector")
     raise
 from pybit.unified_trading import HTTP
+from exchange_handler import ExchangeHandler
 import time
 import json
 from typing import Dict, Optional, List, Any
 
 load_dotenv()
 
+
+def get_order_id(order: Dict[str, Any]) -> Optional[str]:
+    """Extract the order id from a Binance or Bybit order response."""
+    return order.get('orderId', order.get('result', {}).get('orderId'))
+
+
+def get_order_price(order: Dict[str, Any]) -> Optional[float]:
+    """Extract the fill/order price from a Binance or Bybit order response, if present."""
+    return order.get('price') or (order.get('result', {}).get('orderPrice') if 'result' in order else None)
+
+
 class ExchangeManager:
     """
     Unified Exchange Manager that handles both Binance and Bybit connections
@@ -69,7 +81,7 @@ class ExchangeManager:
                     else:
                         raise ValueError(f"Unsupported exchange: {exchange_name}")
                     
-                    self.clients[account_id] = client
+                    self.clients[account_id] = ExchangeHandler.configure_session(client)
                     self.exchange_configs[account_id] = {
                         'exchange': exchange_name,
                         'testnet': use_testnet
@@ -81,6 +93,10 @@ class ExchangeManager:
             raise ValueError(f"No client initialized for account: {account_id}")
         return self.clients[account_id]
     
+    def get_account_ids(self) -> List[str]:
+        """Get the IDs of all accounts with an initialized client"""
+        return list(self.exchange_configs)
+    
     def get_exchange_config(self, account_id: str) -> Dict[str, Any]:
         """Get configuration for a specific account"""
         if account_id not in self.exchange_configs:
@@ -101,7 +117,6 @@ class ExchangeManager:
     ):
         """Execute an order on the specified exchange with advanced options"""
         # Use the ExchangeHandler's execute_order method
-        from exchange_handler import ExchangeHandler
         return ExchangeHandler.execute_order(
             account_id=account_id,
             symbol=symbol,
@@ -114,6 +129,17 @@ class ExchangeManager:
             **kwargs
         )
     
+    def execute_market_close(self, account_id: str, symbol: str, side: str, qty: float):
+        """Execute a reduce-only MARKET order (the exit path) without order-type options"""
+        return ExchangeHandler.execute_order(
+            account_id=account_id,
+            symbol=symbol,
+            side=side,
+            qty=qty,
+            reduce_only=True,
+            order_type="MARKET"
+        )
+    
     def get_last_price(self, account_id: str, symbol: str) -> Optional[float]:
         """Fetch the last traded price for a symbol."""
         client = self.get_client(account_id)
@@ -134,6 +160,26 @@ class ExchangeManager:
             print(f"❌ Error fetching price on {exch_name.upper()}: {str(e)}")
             return None
 
+    def get_last_prices(self, account_id: str, symbols) -> Dict[str, float]:
+        """Fetch last traded prices for several symbols with a single ticker request."""
+        client = self.get_client(account_id)
+        exchange_config = self.get_exchange_config(account_id)
+        exch_name = exchange_config['exchange']
+        wanted = set(symbols)
+        
+        try:
+            if exch_name.lower() == "binance":
+                tickers = client.ticker_price()
+                return {t['symbol']: float(t['price']) for t in tickers if t.get('symbol') in wanted and 'price' in t}
+            elif exch_name.lower() == "bybit":
+                ticker_response = client.get_tickers(category="linear")
+                tickers = ticker_response.get('result', {}).get('list', [])
+                return {t['symbol']: float(t['lastPrice']) for t in tickers if t.get('symbol') in wanted and 'lastPrice' in t}
+            return {}
+        except Exception as e:
+            print(f"❌ Error fetching prices on {exch_name.upper()}: {str(e)}")
+            return {}
+
     def format_quantity(self, exch_name: str, symbol: str, qty: float) -> str:
         """Format quantity according to exchange's precision requirements."""
         qty = float(qty)
@@ -233,81 +279,104 @@ class ExchangeManager:
 
     def get_all_positions(self, account_id: str) -> List[Dict[str, Any]]:
         """Get all positions for an account from the exchange."""
-        client = self.get_client(account_id)
-        exchange_config = self.get_exchange_config(account_id)
-        exch_name = exchange_config['exchange']
-        
+        exch_name = self.get_exchange_config(account_id)['exchange']
         try:
-            if exch_name.lower() == "binance":
-                # Get all positions from Binance
-                account_info = client.account()
-                positions = account_info['positions']
-                
-                # Filter out zero positions and format data
-                filtered_positions = []
-                for position in positions:
-                    position_amt = float(position.get('positionAmt', 0))
-                    if position_amt != 0:  # Only include non-zero positions
-                        # Safely convert string values to floats, handling empty strings
-                        def safe_float(value):
-                            if value == '' or value is None:
-                                return 0.0
-                            try:
-                                return float(value)
-                            except (ValueError, TypeError):
-                                return 0.0
-                        
-                        filtered_positions.append({
-                            'symbol': position['symbol'],
-                            'positionAmt': safe_float(position.get('positionAmt')),
-                            'entryPrice': safe_float(position.get('entryPrice')),
-                            'unRealizedProfit': safe_float(position.get('unRealizedProfit')),
-                            'liquidationPrice': safe_float(position.get('liquidationPrice')),
-                            'leverage': safe_float(position.get('leverage')),
-                            'marginType': position.get('marginType', 'cross'),
-                            'isolatedMargin': safe_float(position.get('isolatedMargin')),
-                            'positionSide': position.get('positionSide', 'BOTH')
-                        })
-                return filtered_positions
-                
-            elif exch_name.lower() == "bybit":
-                # Get all positions from Bybit
-                response = client.get_positions(category="linear")
-                positions = response.get('result', {}).get('list', [])
-                
-                # Filter out zero positions and format data
-                filtered_positions = []
-                for position in positions:
-                    size = float(position.get('size', 0))
-                    if size != 0:  # Only include non-zero positions
-                        # Safely convert string values to floats, handling empty strings
-                        def safe_float(value):
-                            if value == '' or value is None:
-                                return 0.0
-                            try:
-                                return float(value)
-                            except (ValueError, TypeError):
-                                return 0.0
-                        
-                        # Convert side to amount (positive for Buy, negative for Sell)
-                        position_amt = size if position.get('side') == 'Buy' else -size
-                        
-                        filtered_positions.append({
-                            'symbol': position['symbol'],
-                            'positionAmt': position_amt,
-                            'entryPrice': safe_float(position.get('avgPrice')),
-                            'unRealizedProfit': safe_float(position.get('unrealisedPnl')),
-                            'liquidationPrice': safe_float(position.get('liqPrice')),
-                            'leverage': safe_float(position.get('leverage')),
-                            'positionSide': position.get('side', 'Buy')
-                        })
-                return filtered_positions
-                
-            return []
+            return self._fetch_open_positions(account_id)
         except Exception as e:
             print(f"❌ Error fetching all positions from {exch_name.upper()}: {str(e)}")
             return []
 
+    def get_open_positions_by_symbol(self, account_id: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Get all non-zero positions for an account in one request, keyed by symbol.
+        Errors are raised rather than swallowed, so an empty result really means no open positions.
+        """
+        return {position['symbol']: position for position in self._fetch_open_positions(account_id)}
+
+    def _fetch_open_positions(self, account_id: str) -> List[Dict[str, Any]]:
+        """Fetch and normalise every non-zero position for an account; raises on exchange errors."""
+        client = self.get_client(account_id)
+        exchange_config = self.get_exchange_config(account_id)
+        exch_name = exchange_config['exchange']
+        
+        if exch_name.lower() == "binance":
+            # Get all positions from Binance
+            account_info = client.account()
+            positions = account_info['positions']
+            
+            # Filter out zero positions and format data
+            filtered_positions = []
+            for position in positions:
+                position_amt = float(position.get('positionAmt', 0))
+                if position_amt != 0:  # Only include non-zero positions
+                    # Safely convert string values to floats, handling empty strings
+                    def safe_float(value):
+                        if value == '' or value is None:
+                            return 0.0
+                        try:
+                            return float(value)
+                        except (ValueError, TypeError):
+                            return 0.0
+                    
+                    filtered_positions.append({
+                        'symbol': position['symbol'],
+                        'positionAmt': safe_float(position.get('positionAmt')),
+                        'entryPrice': safe_float(position.get('entryPrice')),
+                        'unRealizedProfit': safe_float(position.get('unRealizedProfit')),
+                        'liquidationPrice': safe_float(position.get('liquidationPrice')),
+                        'leverage': safe_float(position.get('leverage')),
+                        'marginType': position.get('marginType', 'cross'),
+                        'isolatedMargin': safe_float(position.get('isolatedMargin')),
+                        'positionSide': position.get('positionSide', 'BOTH')
+                    })
+            return filtered_positions
+            
+        elif exch_name.lower() == "bybit":
+            # Get all positions from Bybit; without a symbol the v5 endpoint needs a settle coin
+            # and returns up to 200 open positions per page
+            positions = []
+            for settle_coin in ("USDT", "USDC"):
+                cursor = None
+                while True:
+                    params = {'category': "linear", 'settleCoin': settle_coin, 'limit': 200}
+                    if cursor:
+                        params['cursor'] = cursor
+                    result = client.get_positions(**params).get('result', {})
+                    positions.extend(result.get('list', []))
+                    cursor = result.get('nextPageCursor')
+                    if not cursor:
+                        break
+            
+            # Filter out zero positions and format data
+            filtered_positions = []
+            for position in positions:
+                size = float(position.get('size', 0))
+                if size != 0:  # Only include non-zero positions
+                    # Safely convert string values to floats, handling empty strings
+                    def safe_float(value):
+                        if value == '' or value is None:
+                            return 0.0
+                        try:
+                            return float(value)
+                        except (ValueError, TypeError):
+                            return 0.0
+                    
+                    # Convert side to amount (positive for Buy, negative for Sell)
+                    position_amt = size if position.get('side') == 'Buy' else -size
+                    
+                    filtered_positions.append({
+                        'symbol': position['symbol'],
+                        'positionAmt': position_amt,
+                        'entryPrice': safe_float(position.get('avgPrice')),
+                        'unRealizedProfit': safe_float(position.get('unrealisedPnl')),
+                        'liquidationPrice': safe_float(position.get('liqPrice')),
+                        'leverage': safe_float(position.get('leverage')),
+                        'positionSide': position.get('side', 'Buy')
+                    })
+            return filtered_positions
+            
+        return []
+
     def get_position_info(self, account_id: str, symbol: str) -> Optional[Dict[str, Any]]:
         """Get current position information for a symbol."""
         client = self.get_client(account_id)
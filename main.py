@@ -1,16 +1,17 @@
 from fastapi import FastAPI, Request, HTTPException, Depends
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from fastapi.responses import HTMLResponse, RedirectResponse, ORJSONResponse
+from sqlalchemy import create_engine, update, case
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.sql.expression import UpdateBase
 from sqlalchemy.pool import QueuePool
 from sqlalchemy.exc import OperationalError
 from sqlalchemy import event
-from models import Base, Position, ProcessedEvent
+from models import Base, Position, PositionOrder, ProcessedEvent
 from exchange_handler import ExchangeHandler
-from position_manager import PositionManager
-from config import DATABASE_URL, WEBHOOK_PASSPHRASE
+from position_manager import PositionManager, _TP_CLOSED_ATTR
+from config import DATABASE_URL, WEBHOOK_PASSPHRASE, ENVIRONMENT, ENGINE_KWARGS
 import os
 from dotenv import load_dotenv
 import json
@@ -18,23 +19,35 @@ from dashboard import router as dashboard_router
 import time
 import logging
 import datetime
+import asyncio
+import atexit
+import queue
+from contextlib import ExitStack
+from logging.handlers import QueueHandler, QueueListener
 
 # Import the new ExchangeManager, Price Monitor, Account Config and Symbol Manager
-from exchange_manager import exchange_manager
+from exchange_manager import exchange_manager, get_order_id, get_order_price
 from price_monitor import init_price_monitor
 from account_config import account_config_manager
 from symbol_manager import symbol_manager
 
 load_dotenv()
 
-# Enhanced logging setup
+# Enhanced logging setup (defaults to WARNING in production to keep per-request log I/O down)
+# Records are queued and written by a listener thread so request handlers and the price monitor never block on I/O
+_log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+_log_handlers = [logging.StreamHandler(), logging.FileHandler('trading_bot.log')]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, *_log_handlers, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+_queue_handler = QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))  # Only merge args; the listener's handlers apply the full format
 logging.basicConfig(
-    level=logging.DEBUG if os.getenv("LOG_LEVEL", "info").lower() == "debug" else logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('trading_bot.log')
-    ]
+    level=getattr(logging, os.getenv("LOG_LEVEL", "warning" if ENVIRONMENT == "production" else "info").upper(), logging.INFO),
+    handlers=[_queue_handler]
 )
 logger = logging.getLogger(__name__)
 
@@ -51,35 +64,83 @@ def execute_with_retry(func, max_retries=7, delay=0.1):
                 "lock wait timeout" in error_msg or 
                 "deadlock" in error_msg or
                 "too many connections" in error_msg) and attempt < max_retries - 1:
-                logging.warning(f"Database issue detected, retrying in {delay}s... (attempt {attempt + 1}/{max_retries})")
+                logger.warning(f"Database issue detected, retrying in {delay}s... (attempt {attempt + 1}/{max_retries})")
                 time.sleep(delay)
                 delay *= 2.5  # Exponential backoff
             else:
                 raise
 
-def get_sqlite_engine():
-    """Create database engine with appropriate settings based on database type."""
+# Quantities at or below this are float dust from earlier partial closes, not something to send to the exchange
+_MIN_CLOSE_QTY = 1e-9
+
+# Event type lookups, built once instead of a list literal per webhook
+_ENTRY_EVENTS = frozenset({"LONG_ENTRY", "SHORT_ENTRY"})
+
+# Partial take-profit event types -> (TP name in the payload's tp_percentages, TP level)
+_PARTIAL_TP_EVENTS = {
+    "TP1_HIT": ("TP1", 1),
+    "TP2_HIT": ("TP2", 2),
+    "TP3_HIT": ("TP3", 3),
+    "TP4_HIT": ("TP4", 4),
+}
+
+# Full-close event types -> (closed quantity column, result action)
+_FULL_CLOSE_EVENTS = {
+    "STOP": ("sl_closed_qty", "stop_loss"),
+    "TP5_HIT": ("closed_qty_tp5", "tp5_exit"),
+    "TIME_GUARD": ("timeguard_closed_qty", "time_guard_exit"),
+    "MAX_BARS": ("maxbars_closed_qty", "max_bars_exit"),
+    "SWING_TP": ("swingtp_closed_qty", "swing_tp_exit"),
+    "DYN_TP": ("dyn_tp_closed_qty", "dyn_tp_exit"),
+    "CLOSE": (None, "close"),
+}
+
+def _signal_position_ids(data):
+    """IDs of the positions a webhook may write, sorted so locks are taken in PositionManager's order."""
+    event_type, symbol, strategy_id = data.get("event_type"), data.get("symbol"), data.get("strategy_id")
+    if (event_type not in _ENTRY_EVENTS and event_type not in _PARTIAL_TP_EVENTS
+            and event_type not in _FULL_CLOSE_EVENTS) or not symbol or not strategy_id:
+        return []
+    accounts = data.get("account_profile") or account_config_manager.get_accounts_for_strategy(strategy_id, symbol)
+    return sorted({f"{acc_id}_{symbol}_{strategy_id}" for acc_id in accounts})
+
+def _bulk_close_positions(db, full_closes):
+    """Close all queued positions with a single UPDATE, using CASE for per-row values."""
+    whens_by_column = {}
+    for pos_id, row_values in full_closes.items():
+        for column, value in row_values.items():
+            whens_by_column.setdefault(column, []).append((Position.id == pos_id, value))
+    
+    per_row_values = {
+        column: case(*whens, else_=getattr(Position, column))
+        for column, whens in whens_by_column.items()
+    }
+    db.execute(
+        update(Position)
+        .where(Position.id.in_(list(full_closes)))
+        .values(status='CLOSED', remaining_qty=0, **per_row_values)
+        .execution_options(synchronize_session=False)
+    )
+
+def get_sqlite_engine(single_writer=False):
+    """Create database engine with appropriate settings based on database type.
+
+    With single_writer, a SQLite engine is limited to one pooled connection so writes queue in Python
+    instead of contending for the database lock.
+    """
     # Determine if using PostgreSQL, MySQL, or SQLite
     if DATABASE_URL.startswith("postgresql://"):
         # PostgreSQL configuration
         engine = create_engine(
             DATABASE_URL,
-            pool_size=20,
-            max_overflow=40,
-            pool_pre_ping=True,
-            pool_recycle=300,
-            pool_timeout=30,
+            **ENGINE_KWARGS,
             echo=False
         )
     elif DATABASE_URL.startswith("mysql://") or DATABASE_URL.startswith("mysql+pymysql://"):
         # MySQL configuration
         engine = create_engine(
             DATABASE_URL,
-            pool_size=20,
-            max_overflow=40,
-            pool_pre_ping=True,
-            pool_recycle=300,
-            pool_timeout=30,
+            **ENGINE_KWARGS,
             echo=False,
             connect_args={
                 "connect_timeout": 30,
@@ -88,14 +149,11 @@ def get_sqlite_engine():
         )
     else:
         # SQLite configuration with WAL mode
+        pool_kwargs = {**ENGINE_KWARGS, "pool_size": 1, "max_overflow": 0} if single_writer else ENGINE_KWARGS
         engine = create_engine(
             DATABASE_URL,
             poolclass=QueuePool,
-            pool_size=20,
-            max_overflow=40,
-            pool_pre_ping=True,
-            pool_recycle=300,
-            pool_timeout=30,
+            **pool_kwargs,
             echo=False,
             connect_args={
                 "timeout": 30,
@@ -112,6 +170,7 @@ def get_sqlite_engine():
             cursor.execute("PRAGMA synchronous=NORMAL")
             cursor.execute("PRAGMA cache_size=10000")
             cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.execute("PRAGMA mmap_size=268435456")  # Serve reads from a 256MB memory map
             cursor.close()
     
     return engine
@@ -121,12 +180,42 @@ engine = get_sqlite_engine()
 # Create all tables, including the new ProcessedEvent
 Base.metadata.create_all(bind=engine)
 
-SessionLocal = sessionmaker(bind=engine)
-position_manager = PositionManager(engine)
-
-# Initialize price monitor for Mode A
+# Positions handed to the price monitor outlive the webhook session, so keep their state loaded after commit
+SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+# SQLite allows one writer at a time, so every writer (webhooks, PositionManager, dashboard-triggered syncs)
+# goes through a dedicated single-connection engine and queues for it in Python instead of on the database lock
+write_engine = get_sqlite_engine(single_writer=True) if engine.dialect.name == "sqlite" else engine
+
+class WriteSession(Session):
+    """Session that reads through the shared engine and only checks out the write connection to flush or run DML.
+
+    Webhooks and syncs talk to the exchange between their reads and their writes, so the single SQLite write
+    connection is held just for the final flush and commit, not across those HTTP calls.
+    """
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or isinstance(clause, UpdateBase):
+            return write_engine
+        return engine
+
+# Without autoflush, queries made before the commit never flush early and grab the write connection
+WriteSessionLocal = sessionmaker(class_=WriteSession, expire_on_commit=False, autoflush=False)
+app.state.WriteSessionLocal = WriteSessionLocal
+position_manager = PositionManager(engine, write_engine)
+# Shared with the dashboard so its syncs take the same per-position locks as webhooks and the price monitor
+app.state.position_manager = position_manager
+
+# Initialize price monitor for Mode A; it runs as a task on the app's event loop
 price_monitor = init_price_monitor(engine, position_manager)
 
+@app.on_event("startup")
+async def start_price_monitor():
+    app.state.price_monitor_task = asyncio.create_task(price_monitor.run())
+
+@app.on_event("shutdown")
+async def stop_price_monitor():
+    price_monitor.stop_monitoring()
+    app.state.price_monitor_task.cancel()
+
 # Include dashboard API routes
 app.include_router(dashboard_router, prefix="", tags=["dashboard-api"])
 
@@ -189,7 +278,7 @@ async def get_status():
     return execute_with_retry(execute_status_logic)
 
 
-@app.post("/webhook")
+@app.post("/webhook", response_class=ORJSONResponse)
 async def handle_signal(request: Request):
     logger.info("=" * 60)
     logger.info("📥 RECEIVED WEBHOOK REQUEST")
@@ -207,31 +296,32 @@ async def handle_signal(request: Request):
         logger.error(f"❌ Failed to parse JSON payload: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Invalid JSON payload: {str(e)}")
     
-    def execute_webhook_logic():
-        db = SessionLocal()
+    # --- Validation ---
+    # Checked before any position lock or database work, so a bad request never waits behind other webhooks
+    logger.info("🔍 STARTING VALIDATION")
+    
+    # Check passphrase
+    received_passphrase = data.get("passphrase")
+    logger.info(f"🔑 Expected passphrase: {WEBHOOK_PASSPHRASE}")
+    logger.info(f"🔑 Received passphrase: {received_passphrase}")
+    
+    if received_passphrase != WEBHOOK_PASSPHRASE:
+        logger.error(f"❌ PASSPHRASE MISMATCH - Expected: {WEBHOOK_PASSPHRASE}, Received: {received_passphrase}")
+        raise HTTPException(status_code=401, detail="Unauthorized - Invalid passphrase")
+    logger.info("✅ Passphrase validation passed")
+
+    # Check event_id
+    event_id = data.get("event_id")
+    logger.info(f"🆔 Event ID: {event_id}")
+    if not event_id:
+        logger.error("❌ Missing event_id in payload")
+        raise HTTPException(status_code=400, detail="Missing event_id")
+    logger.info("✅ Event ID validation passed")
+
+    def process_webhook():
+        db = WriteSessionLocal()
 
         try:
-            # --- Validation ---
-            logger.info("🔍 STARTING VALIDATION")
-            
-            # Check passphrase
-            received_passphrase = data.get("passphrase")
-            logger.info(f"🔑 Expected passphrase: {WEBHOOK_PASSPHRASE}")
-            logger.info(f"🔑 Received passphrase: {received_passphrase}")
-            
-            if received_passphrase != WEBHOOK_PASSPHRASE:
-                logger.error(f"❌ PASSPHRASE MISMATCH - Expected: {WEBHOOK_PASSPHRASE}, Received: {received_passphrase}")
-                raise HTTPException(status_code=401, detail="Unauthorized - Invalid passphrase")
-            logger.info("✅ Passphrase validation passed")
-
-            # Check event_id
-            event_id = data.get("event_id")
-            logger.info(f"🆔 Event ID: {event_id}")
-            if not event_id:
-                logger.error("❌ Missing event_id in payload")
-                raise HTTPException(status_code=400, detail="Missing event_id")
-            logger.info("✅ Event ID validation passed")
-
             # --- Idempotency Check ---
             if db.query(ProcessedEvent).filter(ProcessedEvent.event_id == event_id).first():
                 raise HTTPException(status_code=409, detail="Event already processed")
@@ -290,7 +380,9 @@ async def handle_signal(request: Request):
             # Process each account with better error isolation
             logger.info(f"👥 Processing accounts: {accounts}")
             processing_results = {}
+            full_closes = {}  # pos_id -> per-row column values, flushed in one UPDATE
             all_successful = True
+            orders_sent = False  # once an exchange order is placed, the event must stay recorded as processed
             
             for acc_id in accounts:
                 logger.info(f"⚙️ Processing account: {acc_id}")
@@ -299,17 +391,17 @@ async def handle_signal(request: Request):
                     # Get account-specific configuration
                     acc_config = account_config_manager.get_account_config(acc_id)
                     if not acc_config or not acc_config.get('enabled', False):
-                        print(f"⚠️ Account {acc_id} is disabled, skipping")
+                        logger.warning(f"⚠️ Account {acc_id} is disabled, skipping")
                         continue
                     
                     # Check if symbol is allowed for this account
                     if not account_config_manager.is_symbol_allowed(acc_id, symbol):
-                        print(f"⚠️ Symbol {symbol} not allowed for account {acc_id}, skipping")
+                        logger.warning(f"⚠️ Symbol {symbol} not allowed for account {acc_id}, skipping")
                         continue
                     
                     # Check if symbol is allowed for this strategy
                     if not symbol_manager.is_symbol_allowed_for_strategy(symbol, strategy_id, acc_id):
-                        print(f"⚠️ Symbol {symbol} not allowed for strategy {strategy_id} on account {acc_id}, skipping")
+                        logger.warning(f"⚠️ Symbol {symbol} not allowed for strategy {strategy_id} on account {acc_id}, skipping")
                         continue
                     
                     # Use account-specific defaults if not provided in webhook
@@ -338,17 +430,24 @@ async def handle_signal(request: Request):
                                         
                     logger.info(f"📊 Final quantity: {quantity}")
                     
-                    # Get position within the same DB session
-                    pos = db.query(Position).filter(
+                    # Get position within the same DB session, row-locked (FOR UPDATE is a no-op on SQLite, which relies on WAL)
+                    pos_query = db.query(Position).filter(
                         Position.id == f"{acc_id}_{symbol}_{strategy_id}",
                         Position.status == 'OPEN'
-                    ).first()
+                    )
+                    if event_type in _ENTRY_EVENTS:
+                        # An entry can skip a row another webhook holds; the fallback lookup below still blocks pyramiding
+                        pos = pos_query.with_for_update(skip_locked=True).one_or_none()
+                    else:
+                        # Exits must see the position, so wait for a concurrent webhook to release it
+                        # rather than dropping the event as "No open position found"
+                        pos = pos_query.with_for_update().one_or_none()
 
                     # 1. ENTRY LOGIC - Arts One Two Three Strategy
-                    if event_type in ["LONG_ENTRY", "SHORT_ENTRY"]:
+                    if event_type in _ENTRY_EVENTS:
                         # No-pyramiding: ignore new entry if position already open for this symbol/account
                         if pos:
-                            print(f"⚠️ Position already open for {acc_id}_{symbol}_{strategy_id}, ignoring new entry request")
+                            logger.warning(f"⚠️ Position already open for {acc_id}_{symbol}_{strategy_id}, ignoring new entry request")
                             processing_results[acc_id] = {"status": "warning", "action": "entry", "message": "Position already open, pyramiding blocked"}
                             continue
                         elif not pos:
@@ -356,13 +455,18 @@ async def handle_signal(request: Request):
                             existing_pos = db.query(Position).filter(
                                 Position.id == f"{acc_id}_{symbol}_{strategy_id}"
                             ).first()
+                            if existing_pos and existing_pos.status == 'OPEN':
+                                # Open but locked by a concurrent webhook, so SKIP LOCKED returned nothing above
+                                logger.warning(f"⚠️ Position {acc_id}_{symbol}_{strategy_id} is being updated by another request, ignoring new entry request")
+                                processing_results[acc_id] = {"status": "warning", "action": "entry", "message": "Position already open, pyramiding blocked"}
+                                continue
                             if existing_pos and existing_pos.status != 'OPEN':
                                 try:
                                     # Update the existing closed position to OPEN instead of creating a new one
                                     # Determine entry side based on event_type or side field
                                     order_side = "buy" if "LONG" in event_type or side == "long" else "sell"
                                     
-                                    print(f"DEBUG: Attempting {order_side} on {acc_id} for {symbol}")
+                                    logger.debug(f"Attempting {order_side} on {acc_id} for {symbol}")
                                     
                                     # Execute order using ExchangeManager
                                     order_params = {
@@ -380,16 +484,18 @@ async def handle_signal(request: Request):
                                         order_params["price"] = data["price"]
                                     
                                     order = exchange_manager.execute_order(**order_params)
+                                    orders_sent = True
+                                    order_id = get_order_id(order)
                                     
                                     # --- Price Fallback Logic ---
-                                    price = order.get('price') or (order.get('result', {}).get('orderPrice') if 'result' in order else None)
+                                    price = get_order_price(order)
                                     if not price:
                                         try:
                                             # Fallback to last price if order price not available
-                                            print(f"ℹ️ Order price not available, falling back to last ticker price for {symbol} on {acc_id}.")
+                                            logger.info(f"ℹ️ Order price not available, falling back to last ticker price for {symbol} on {acc_id}.")
                                             price = exchange_manager.get_last_price(acc_id, symbol)
                                         except Exception as e:
-                                            print(f"⚠️ Could not fetch price for {symbol} on {acc_id}: {e}")
+                                            logger.warning(f"⚠️ Could not fetch price for {symbol} on {acc_id}: {e}")
 
                                     if not price:
                                         raise Exception("Could not determine entry price.")
@@ -409,16 +515,17 @@ async def handle_signal(request: Request):
                                     existing_pos.tp_levels = json.dumps(tp_levels) if tp_levels else None
                                     existing_pos.sl_price = sl_price
                                     existing_pos.entry_strategy = entry_strategy
+                                    db.add(PositionOrder(position_id=existing_pos.id, order_id=order_id, action="entry"))
                                     
-                                    print(f"DEBUG: Reopened existing position for {acc_id}_{symbol}_{strategy_id}")
-                                    processing_results[acc_id] = {"status": "success", "action": "entry", "order_id": order.get('orderId', order.get('result', {}).get('orderId'))}
+                                    logger.debug(f"Reopened existing position for {acc_id}_{symbol}_{strategy_id}")
+                                    processing_results[acc_id] = {"status": "success", "action": "entry", "order_id": order_id}
                                     
                                     # Add to price monitor if using Mode A (TP levels provided at entry)
                                     if tp_levels:
                                         price_monitor.add_position_to_monitor(acc_id, symbol, existing_pos)
-                                        print(f"DEBUG: Added {symbol} position to price monitor for Mode A")
+                                        logger.debug(f"Added {symbol} position to price monitor for Mode A")
                                 except Exception as e:
-                                    print(f"❌ Exchange Error on {acc_id}: {str(e)}")
+                                    logger.error(f"❌ Exchange Error on {acc_id}: {str(e)}")
                                     processing_results[acc_id] = {"status": "error", "action": "entry", "error": str(e)}
                                     all_successful = False
                                     # Continue processing other accounts
@@ -427,7 +534,7 @@ async def handle_signal(request: Request):
                                     # Determine entry side based on event_type or side field
                                     order_side = "buy" if "LONG" in event_type or side == "long" else "sell"
                                     
-                                    print(f"DEBUG: Attempting {order_side} on {acc_id} for {symbol}")
+                                    logger.debug(f"Attempting {order_side} on {acc_id} for {symbol}")
                                     
                                     # Execute order using ExchangeManager
                                     order_params = {
@@ -445,16 +552,18 @@ async def handle_signal(request: Request):
                                         order_params["price"] = data["price"]
                                     
                                     order = exchange_manager.execute_order(**order_params)
+                                    orders_sent = True
+                                    order_id = get_order_id(order)
                                     
                                     # --- Price Fallback Logic ---
-                                    price = order.get('price') or (order.get('result', {}).get('orderPrice') if 'result' in order else None)
+                                    price = get_order_price(order)
                                     if not price:
                                         try:
                                             # Fallback to last price if order price not available
-                                            print(f"ℹ️ Order price not available, falling back to last ticker price for {symbol} on {acc_id}.")
+                                            logger.info(f"ℹ️ Order price not available, falling back to last ticker price for {symbol} on {acc_id}.")
                                             price = exchange_manager.get_last_price(acc_id, symbol)
                                         except Exception as e:
-                                            print(f"⚠️ Could not fetch price for {symbol} on {acc_id}: {e}")
+                                            logger.warning(f"⚠️ Could not fetch price for {symbol} on {acc_id}: {e}")
 
                                     if not price:
                                         raise Exception("Could not determine entry price.")
@@ -468,21 +577,22 @@ async def handle_signal(request: Request):
                                         side=order_side,
                                         qty=quantity,
                                         price=price, # Use the determined price
-                                        order_id=order.get('orderId', order.get('result', {}).get('orderId')),
+                                        order_id=order_id,
                                         leverage=leverage,
                                         margin_mode=margin_mode,
                                         tp_levels=tp_levels,
-                                        sl_price=sl_price
+                                        sl_price=sl_price,
+                                        db=db
                                     )
-                                    print(f"DEBUG: Successfully opened {order_side} position. Order ID: {order.get('orderId', order.get('result', {}).get('orderId'))}")
-                                    processing_results[acc_id] = {"status": "success", "action": "entry", "order_id": order.get('orderId', order.get('result', {}).get('orderId'))}
+                                    logger.debug(f"Successfully opened {order_side} position. Order ID: {order_id}")
+                                    processing_results[acc_id] = {"status": "success", "action": "entry", "order_id": order_id}
                                     
                                     # Add to price monitor if using Mode A (TP levels provided at entry)
                                     if tp_levels:
                                         price_monitor.add_position_to_monitor(acc_id, symbol, new_position)
-                                        print(f"DEBUG: Added {symbol} position to price monitor for Mode A")
+                                        logger.debug(f"Added {symbol} position to price monitor for Mode A")
                                 except Exception as e:
-                                    print(f"❌ Exchange Error on {acc_id}: {str(e)}")
+                                    logger.error(f"❌ Exchange Error on {acc_id}: {str(e)}")
                                     processing_results[acc_id] = {"status": "error", "action": "entry", "error": str(e)}
                                     all_successful = False
                                     # Continue processing other accounts
@@ -493,206 +603,120 @@ async def handle_signal(request: Request):
                         exit_side = "sell" if pos.side == "buy" else "buy"
                         
                         # Partial TP - Arts One Two Three TP1-TP4
-                        if event_type in ["TP1_HIT", "TP2_HIT", "TP3_HIT", "TP4_HIT"]:
+                        if event_type in _PARTIAL_TP_EVENTS:
+                            # Read ORM attributes once; remaining_qty is written back once after the order
+                            remaining, initial = pos.remaining_qty, pos.initial_qty
+                            
+                            # Check if there's anything left to close before sending an order the exchange would reject
+                            if remaining <= _MIN_CLOSE_QTY:
+                                logger.warning(f"⚠️ No remaining quantity to close for {acc_id}_{symbol}_{strategy_id}, skipping close order")
+                                processing_results[acc_id] = {"status": "warning", "action": "partial_exit", "message": "Nothing to close"}
+                                continue
+                            
                             try:
                                 # Calculate close quantity based on custom percentages from webhook payload or use defaults
                                 # Check if custom TP percentages are provided in the webhook data
                                 custom_tp_percentages = data.get("tp_percentages", {})
+                                tp_name, tp_level = _PARTIAL_TP_EVENTS[event_type]
+                                tp_percentage = custom_tp_percentages.get(tp_name, 0.2)  # Default 20% per TP (TP1 covers fees)
                                 
-                                if event_type == "TP1_HIT":
-                                    tp_percentage = custom_tp_percentages.get("TP1", 0.2)  # Default 20% for TP1 (to cover fees)
-                                elif event_type == "TP2_HIT":
-                                    tp_percentage = custom_tp_percentages.get("TP2", 0.2)  # Default 20% for TP2
-                                elif event_type == "TP3_HIT":
-                                    tp_percentage = custom_tp_percentages.get("TP3", 0.2)  # Default 20% for TP3
-                                elif event_type == "TP4_HIT":
-                                    tp_percentage = custom_tp_percentages.get("TP4", 0.2)  # Default 20% for TP4
-                                
-                                close_qty = pos.initial_qty * tp_percentage
+                                close_qty = initial * tp_percentage
                                 
-                                # Ensure close quantity is positive and not greater than remaining quantity
-                                close_qty = max(0.000001, min(close_qty, pos.remaining_qty))  # Minimum quantity to avoid zero
+                                # Ensure close quantity is not greater than remaining quantity
+                                close_qty = min(close_qty, remaining)
                                 
-                                logger.info(f"📊 Calculating close quantity: initial={pos.initial_qty}, percent={tp_percentage}, close={close_qty}, remaining={pos.remaining_qty}")
+                                logger.info(f"📊 Calculating close quantity: initial={initial}, percent={tp_percentage}, close={close_qty}, remaining={remaining}")
                                 
-                                if close_qty <= 0 or pos.remaining_qty <= 0:
-                                    logger.warning(f"⚠️ Cannot close position: close_qty={close_qty}, remaining_qty={pos.remaining_qty}")
+                                if close_qty <= _MIN_CLOSE_QTY:
+                                    logger.warning(f"⚠️ Cannot close position: close_qty={close_qty}, remaining_qty={remaining}")
                                     processing_results[acc_id] = {"status": "warning", "action": "partial_exit", "message": "Nothing to close"}
                                     continue
                                 
                                 # Execute partial close order
-                                order = exchange_manager.execute_order(
+                                order = exchange_manager.execute_market_close(
                                     account_id=acc_id,
                                     symbol=symbol,
                                     side=exit_side,
-                                    qty=close_qty,
-                                    reduce_only=True,
-                                    order_type=order_type
+                                    qty=close_qty
                                 )
+                                orders_sent = True
+                                order_id, price = get_order_id(order), get_order_price(order)
                                 
-                                # Determine TP level from event type
-                                tp_level = int(event_type[2]) if event_type.startswith("TP") and len(event_type) > 2 else None
+                                # Ensure entry price is preserved (set once on open, so this usually short-circuits)
+                                if not pos.entry_price and price:
+                                    pos.entry_price = price
                                 
                                 # Update position directly in the same session
-                                pos.remaining_qty -= close_qty
+                                pos.remaining_qty = remaining - close_qty
                                 
-                                # Track which TP level was hit
-                                if tp_level == 1:
-                                    pos.closed_qty_tp1 += close_qty
-                                elif tp_level == 2:
-                                    pos.closed_qty_tp2 += close_qty
-                                elif tp_level == 3:
-                                    pos.closed_qty_tp3 += close_qty
-                                elif tp_level == 4:
-                                    pos.closed_qty_tp4 += close_qty
-                                elif tp_level == 5:
-                                    pos.closed_qty_tp5 += close_qty
+                                # Track which TP level was hit, using PositionManager's level -> column table
+                                closed_attr = _TP_CLOSED_ATTR[tp_level]
+                                setattr(pos, closed_attr, getattr(pos, closed_attr) + close_qty)
+                                pos.tp_level = max(pos.tp_level, tp_level)
                                 
-                                # Update TP level if applicable
-                                if tp_level is not None:
-                                    pos.tp_level = max(pos.tp_level, tp_level)
-                                else:
-                                    pos.tp_level += 1
-                                
-                                # Update order IDs list
-                                order_ids = json.loads(pos.order_ids or '[]')
-                                order_ids.append(order.get('orderId', order.get('result', {}).get('orderId')))
-                                pos.order_ids = json.dumps(order_ids)
-                                
-                                # Ensure entry price is preserved
-                                if not pos.entry_price:
-                                    # Try to get the entry price from the order if not set
-                                    pos.entry_price = order.get('price') or (order.get('result', {}).get('orderPrice') if 'result' in order else None)
+                                # Record the exit order
+                                db.add(PositionOrder(position_id=pos.id, order_id=order_id, action="partial_exit"))
                                 
-                                processing_results[acc_id] = {"status": "success", "action": "partial_exit", "order_id": order.get('orderId', order.get('result', {}).get('orderId')), "tp_level": tp_level}
+                                processing_results[acc_id] = {"status": "success", "action": "partial_exit", "order_id": order_id, "tp_level": tp_level}
 
                             except Exception as e:
-                                print(f"❌ Exchange Error on {acc_id}: {str(e)}")
+                                logger.error(f"❌ Exchange Error on {acc_id}: {str(e)}")
                                 processing_results[acc_id] = {"status": "error", "action": "partial_exit", "error": str(e)}
                                 all_successful = False
                                 # Continue processing other accounts
 
                         # Full Close - Arts One Two Three various exit types
-                        elif event_type in ["STOP", "TP5_HIT", "TIME_GUARD", "MAX_BARS", "SWING_TP", "DYN_TP", "CLOSE"]:
-                            # Check if there's anything left to close
-                            if pos.remaining_qty <= 0:
+                        elif event_type in _FULL_CLOSE_EVENTS:
+                            # Check if there's anything left to close before sending an order the exchange would reject
+                            close_qty = pos.remaining_qty
+                            if close_qty <= _MIN_CLOSE_QTY:
                                 logger.warning(f"⚠️ No remaining quantity to close for {acc_id}_{symbol}_{strategy_id}, skipping close order")
                                 processing_results[acc_id] = {"status": "warning", "action": "exit", "message": "No remaining quantity to close"}
                                 continue
                             
-                            # Ensure close quantity is positive
-                            close_qty = max(0.000001, pos.remaining_qty)  # Minimum quantity to avoid zero
                             logger.info(f"📊 Full close quantity: {close_qty}")
                             
                             try:
                                 # Execute full close order
-                                order = exchange_manager.execute_order(
+                                order = exchange_manager.execute_market_close(
                                     account_id=acc_id,
                                     symbol=symbol,
                                     side=exit_side,
-                                    qty=close_qty,
-                                    reduce_only=True,
-                                    order_type=order_type
+                                    qty=close_qty
                                 )
+                                orders_sent = True
+                                order_id, price = get_order_id(order), get_order_price(order)
+                                
+                                # Ensure entry price is preserved (set once on open, so this usually short-circuits)
+                                if not pos.entry_price and price:
+                                    pos.entry_price = price
+                                
+                                # Queue the close; all full closes for this event are written in one UPDATE below
+                                closed_column, action = _FULL_CLOSE_EVENTS[event_type]
+                                db.add(PositionOrder(position_id=pos.id, order_id=order_id, action=action))
+                                row_values = {}
+                                if closed_column:
+                                    row_values[closed_column] = getattr(Position, closed_column) + close_qty
                                 
-                                # Handle different exit types with appropriate tracking
                                 if event_type == "STOP":
-                                    # Stop loss exit (base SL, swing SL, SFP SL, body SL, ATR trail, structure trail, chandelier trail)
-                                    pos.remaining_qty -= pos.remaining_qty  # Close entire remaining quantity
-                                    pos.sl_closed_qty += pos.remaining_qty
-                                    
-                                    # Update order IDs list
-                                    order_ids = json.loads(pos.order_ids or '[]')
-                                    order_ids.append(order.get('orderId', order.get('result', {}).get('orderId')))
-                                    pos.order_ids = json.dumps(order_ids)
-                                    
-                                    # Ensure entry price is preserved
-                                    if not pos.entry_price:
-                                        # Try to get the entry price from the order if not set
-                                        pos.entry_price = order.get('price') or (order.get('result', {}).get('orderPrice') if 'result' in order else None)
-                                    
                                     # Set stop loss type for tracking purposes
-                                    pos.sl_type = 'base'  # Default to base, could be extended based on event_type
-                                    processing_results[acc_id] = {"status": "success", "action": "stop_loss", "order_id": order.get('orderId', order.get('result', {}).get('orderId'))}
-                                elif event_type == "SWING_TP":
-                                    # Swing TP close
-                                    pos.remaining_qty -= pos.remaining_qty  # Close entire remaining quantity
-                                    pos.swingtp_closed_qty += pos.remaining_qty
-                                    
-                                    # Update order IDs list
-                                    order_ids = json.loads(pos.order_ids or '[]')
-                                    order_ids.append(order.get('orderId', order.get('result', {}).get('orderId')))
-                                    pos.order_ids = json.dumps(order_ids)
-                                    
-                                    processing_results[acc_id] = {"status": "success", "action": "swing_tp_exit", "order_id": order.get('orderId', order.get('result', {}).get('orderId'))}
-                                elif event_type == "DYN_TP":
-                                    # Dynamic TP close
-                                    pos.remaining_qty -= pos.remaining_qty  # Close entire remaining quantity
-                                    pos.dyn_tp_closed_qty += pos.remaining_qty
-                                    
-                                    # Update order IDs list
-                                    order_ids = json.loads(pos.order_ids or '[]')
-                                    order_ids.append(order.get('orderId', order.get('result', {}).get('orderId')))
-                                    pos.order_ids = json.dumps(order_ids)
-                                    
-                                    processing_results[acc_id] = {"status": "success", "action": "dyn_tp_exit", "order_id": order.get('orderId', order.get('result', {}).get('orderId'))}
-                                elif event_type == "TIME_GUARD":
-                                    # TimeGuard exit
-                                    pos.remaining_qty -= pos.remaining_qty  # Close entire remaining quantity
-                                    pos.timeguard_closed_qty += pos.remaining_qty
-                                    
-                                    # Update order IDs list
-                                    order_ids = json.loads(pos.order_ids or '[]')
-                                    order_ids.append(order.get('orderId', order.get('result', {}).get('orderId')))
-                                    pos.order_ids = json.dumps(order_ids)
-                                    
-                                    processing_results[acc_id] = {"status": "success", "action": "time_guard_exit", "order_id": order.get('orderId', order.get('result', {}).get('orderId'))}
-                                elif event_type == "MAX_BARS":
-                                    # MaxBars exit
-                                    pos.remaining_qty -= pos.remaining_qty  # Close entire remaining quantity
-                                    pos.maxbars_closed_qty += pos.remaining_qty
-                                    
-                                    # Update order IDs list
-                                    order_ids = json.loads(pos.order_ids or '[]')
-                                    order_ids.append(order.get('orderId', order.get('result', {}).get('orderId')))
-                                    pos.order_ids = json.dumps(order_ids)
-                                    
-                                    processing_results[acc_id] = {"status": "success", "action": "max_bars_exit", "order_id": order.get('orderId', order.get('result', {}).get('orderId'))}
+                                    row_values["sl_type"] = 'base'  # Default to base, could be extended based on event_type
                                 elif event_type == "TP5_HIT":
                                     # TP5 - Final take profit
-                                    pos.remaining_qty -= pos.remaining_qty  # Close entire remaining quantity
-                                    pos.closed_qty_tp5 += pos.remaining_qty
-                                    
-                                    # Update order IDs list
-                                    order_ids = json.loads(pos.order_ids or '[]')
-                                    order_ids.append(order.get('orderId', order.get('result', {}).get('orderId')))
-                                    pos.order_ids = json.dumps(order_ids)
-                                    
-                                    # Update TP level
-                                    pos.tp_level = max(pos.tp_level, 5)
-                                    
-                                    # Then close the position completely
-                                    pos.status = 'CLOSED'
-                                    processing_results[acc_id] = {"status": "success", "action": "tp5_exit", "order_id": order.get('orderId', order.get('result', {}).get('orderId')), "tp_level": 5}
-                                else:
-                                    # Generic close
-                                    pos.remaining_qty = 0
-                                    pos.status = 'CLOSED'
-                                    
-                                    # Update order IDs list
-                                    order_ids = json.loads(pos.order_ids or '[]')
-                                    order_ids.append(order.get('orderId', order.get('result', {}).get('orderId')))
-                                    pos.order_ids = json.dumps(order_ids)
-                                    
-                                    processing_results[acc_id] = {"status": "success", "action": "close", "order_id": order.get('orderId', order.get('result', {}).get('orderId'))}
+                                    row_values["tp_level"] = max(pos.tp_level or 0, 5)
+                                
+                                full_closes[pos.id] = row_values
+                                processing_results[acc_id] = {"status": "success", "action": action, "order_id": order_id}
+                                if event_type == "TP5_HIT":
+                                    processing_results[acc_id]["tp_level"] = 5
                             except Exception as e:
                                 error_str = str(e)
                                 # Check if the error is related to zero quantity
                                 if "Quantity less than or equal to zero" in error_str or "reduce-only order qty" in error_str:
-                                    print(f"⚠️ Quantity error for {acc_id}_{symbol}_{strategy_id}: {error_str}, treating as warning")
+                                    logger.warning(f"⚠️ Quantity error for {acc_id}_{symbol}_{strategy_id}: {error_str}, treating as warning")
                                     processing_results[acc_id] = {"status": "warning", "action": "exit", "message": "No remaining quantity to close", "error": error_str}
                                 else:
-                                    print(f"❌ Exchange Error on {acc_id}: {error_str}")
+                                    logger.error(f"❌ Exchange Error on {acc_id}: {error_str}")
                                     processing_results[acc_id] = {"status": "error", "action": "close", "error": error_str}
                                     all_successful = False
                                 # Continue processing other accounts
@@ -700,27 +724,28 @@ async def handle_signal(request: Request):
                         # No position found for exit event
                         processing_results[acc_id] = {"status": "warning", "action": "exit", "message": "No open position found"}
                 except Exception as e:
-                    print(f"❌ Processing Error for {acc_id}: {str(e)}")
+                    logger.error(f"❌ Processing Error for {acc_id}: {str(e)}")
                     processing_results[acc_id] = {"status": "error", "action": "unknown", "error": str(e)}
                     all_successful = False
                     # Continue processing other accounts
             
-            # Only commit if at least one account was processed successfully
-            # This allows partial success for multi-account signals
-            if all_successful or processing_results:
-                db.commit()
-            else:
-                # If all accounts failed, rollback
+            # Commit once unless every account failed; this allows partial success for multi-account signals
+            all_failed = not all_successful and all(result.get('status') == 'error' for result in processing_results.values())
+            if all_failed and not orders_sent:
+                # Nothing reached the exchange, so drop the event and let the provider redeliver it
                 db.rollback()
-                # Raise error only if all accounts failed
-                all_failed = all(result.get('status') == 'error' for result in processing_results.values())
-                if all_failed and processing_results:
-                    raise HTTPException(status_code=500, detail=f"All accounts failed: {processing_results}")
+                raise HTTPException(status_code=500, detail=f"All accounts failed: {processing_results}")
+            
+            # Orders already placed must never be replayed: keep the ProcessedEvent even if every account failed afterwards
+            if full_closes:
+                _bulk_close_positions(db, full_closes)
+            db.commit()
+            
+            if all_failed:
+                raise HTTPException(status_code=500, detail=f"All accounts failed after placing orders: {processing_results}")
             
             # Return processing results to provide visibility into what happened
             return {"status": "processed", "event_id": event_id, "results": processing_results}
-            
-            db.commit()
 
         except HTTPException:
             # Re-raise HTTP exceptions without closing the session here
@@ -733,5 +758,15 @@ async def handle_signal(request: Request):
             # Always close the session
             db.close()
 
-    # Execute with retry logic for database locking errors
-    return execute_with_retry(execute_webhook_logic)
\ No newline at end of file
+    def execute_webhook_logic():
+        # Exits write positions the price monitor may be closing too, and entries must not race each other
+        # into pyramiding now that reads no longer queue on the write connection, so hold their PositionManager
+        # locks until the transaction ends; they are taken before the session checks out a connection
+        with ExitStack() as position_locks:
+            for pos_id in _signal_position_ids(data):
+                position_locks.enter_context(position_manager.position_lock(pos_id))
+            return process_webhook()
+
+    # Execute with retry logic for database locking errors; the position locks and exchange clients block,
+    # so the whole attempt runs in a worker thread instead of on the event loop
+    return await asyncio.to_thread(execute_with_retry, execute_webhook_logic)
\ No newline at end of file
@@ -1,48 +1,65 @@
-from sqlalchemy import Column, String, Float, Integer, DateTime, func
-from sqlalchemy import Text
-from sqlalchemy.ext.declarative import declarative_base
+from typing import Optional
+from sqlalchemy import String, Float, Integer, DateTime, ForeignKey, Index, func
+from sqlalchemy import Text, text
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 import datetime
 
-Base = declarative_base()
+class Base(DeclarativeBase):
+    pass
 
 class ProcessedEvent(Base):
     __tablename__ = 'processed_events'
     
-    event_id = Column(String(255), primary_key=True)
-    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    event_id: Mapped[str] = mapped_column(String(255), primary_key=True)
+    timestamp: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime, default=datetime.datetime.utcnow)
 
 class Position(Base):
     __tablename__ = 'positions'
+    __table_args__ = (
+        Index('ix_position_status_account', 'status', 'account_id'),  # Open-position counts, optionally per account
+        # Only live rows are indexed, so lookups stay small as CLOSED rows accumulate
+        Index('ix_position_open', 'account_id', 'symbol', 'strategy_id',
+              sqlite_where=text("status = 'OPEN'"), postgresql_where=text("status = 'OPEN'")),
+    )
     
     # ID: account_id + symbol + strategy_id
-    id = Column(String(255), primary_key=True)
-    account_id = Column(String(100))
-    symbol = Column(String(20))
-    strategy_id = Column(String(100))
-    side = Column(String(10)) # 'long' or 'short'
-    initial_qty = Column(Float)
-    remaining_qty = Column(Float)
-    status = Column(String(20), default='OPEN') # 'OPEN' or 'CLOSED'
-    tp_level = Column(Integer, default=0) # Tracks TP1-TP5
-    closed_qty_tp1 = Column(Float, default=0.0)  # Quantity closed at TP1
-    closed_qty_tp2 = Column(Float, default=0.0)  # Quantity closed at TP2
-    closed_qty_tp3 = Column(Float, default=0.0)  # Quantity closed at TP3
-    closed_qty_tp4 = Column(Float, default=0.0)  # Quantity closed at TP4
-    closed_qty_tp5 = Column(Float, default=0.0)  # Quantity closed at TP5
-    sl_closed_qty = Column(Float, default=0.0)   # Quantity closed by stop loss
-    timeguard_closed_qty = Column(Float, default=0.0)  # Quantity closed by TimeGuard
-    maxbars_closed_qty = Column(Float, default=0.0)    # Quantity closed by MaxBars
-    swingtp_closed_qty = Column(Float, default=0.0)    # Quantity closed by SwingTP
-    dyn_tp_closed_qty = Column(Float, default=0.0)     # Quantity closed by DynTP
-    other_closed_qty = Column(Float, default=0.0)      # Quantity closed by other means
-    entry_price = Column(Float)
-    order_ids = Column(Text) # Store as JSON string list
-    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    id: Mapped[str] = mapped_column(String(255), primary_key=True)
+    account_id: Mapped[Optional[str]] = mapped_column(String(100))
+    symbol: Mapped[Optional[str]] = mapped_column(String(20))
+    strategy_id: Mapped[Optional[str]] = mapped_column(String(100))
+    side: Mapped[Optional[str]] = mapped_column(String(10)) # 'long' or 'short'
+    initial_qty: Mapped[Optional[float]] = mapped_column(Float)
+    remaining_qty: Mapped[Optional[float]] = mapped_column(Float)
+    status: Mapped[Optional[str]] = mapped_column(String(20), default='OPEN') # 'OPEN' or 'CLOSED'
+    tp_level: Mapped[Optional[int]] = mapped_column(Integer, default=0) # Tracks TP1-TP5
+    closed_qty_tp1: Mapped[Optional[float]] = mapped_column(Float, default=0.0)  # Quantity closed at TP1
+    closed_qty_tp2: Mapped[Optional[float]] = mapped_column(Float, default=0.0)  # Quantity closed at TP2
+    closed_qty_tp3: Mapped[Optional[float]] = mapped_column(Float, default=0.0)  # Quantity closed at TP3
+    closed_qty_tp4: Mapped[Optional[float]] = mapped_column(Float, default=0.0)  # Quantity closed at TP4
+    closed_qty_tp5: Mapped[Optional[float]] = mapped_column(Float, default=0.0)  # Quantity closed at TP5
+    sl_closed_qty: Mapped[Optional[float]] = mapped_column(Float, default=0.0)   # Quantity closed by stop loss
+    timeguard_closed_qty: Mapped[Optional[float]] = mapped_column(Float, default=0.0)  # Quantity closed by TimeGuard
+    maxbars_closed_qty: Mapped[Optional[float]] = mapped_column(Float, default=0.0)    # Quantity closed by MaxBars
+    swingtp_closed_qty: Mapped[Optional[float]] = mapped_column(Float, default=0.0)    # Quantity closed by SwingTP
+    dyn_tp_closed_qty: Mapped[Optional[float]] = mapped_column(Float, default=0.0)     # Quantity closed by DynTP
+    other_closed_qty: Mapped[Optional[float]] = mapped_column(Float, default=0.0)      # Quantity closed by other means
+    entry_price: Mapped[Optional[float]] = mapped_column(Float)
+    updated_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
     
     # Additional fields for Arts One Two Three strategy
-    leverage = Column(Integer, default=1)              # Leverage used for position
-    margin_mode = Column(String(20), default='cross')      # 'cross' or 'isolated'
-    sl_type = Column(String(50), default='base')           # Type of stop loss: base, swing, sfp, body, atr_trail, structure_trail, chandelier_trail
-    sl_price = Column(Float)                           # Stop loss price (for Mode A)
-    tp_levels = Column(Text)                         # JSON string of TP levels with prices and percentages (for Mode A)
-    entry_strategy = Column(String(50), default='sfp')     # Entry strategy: sfp, volume_spike, etc.
\ No newline at end of file
+    leverage: Mapped[Optional[int]] = mapped_column(Integer, default=1)              # Leverage used for position
+    margin_mode: Mapped[Optional[str]] = mapped_column(String(20), default='cross')      # 'cross' or 'isolated'
+    sl_type: Mapped[Optional[str]] = mapped_column(String(50), default='base')           # Type of stop loss: base, swing, sfp, body, atr_trail, structure_trail, chandelier_trail
+    sl_price: Mapped[Optional[float]] = mapped_column(Float)                           # Stop loss price (for Mode A)
+    tp_levels: Mapped[Optional[str]] = mapped_column(Text)                         # JSON string of TP levels with prices and percentages (for Mode A)
+    entry_strategy: Mapped[Optional[str]] = mapped_column(String(50), default='sfp')     # Entry strategy: sfp, volume_spike, etc.
+
+class PositionOrder(Base):
+    __tablename__ = 'position_orders'
+    
+    # One row per exchange order placed against a position (append-only)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    position_id: Mapped[Optional[str]] = mapped_column(String(255), ForeignKey('positions.id'), index=True)
+    order_id: Mapped[Optional[str]] = mapped_column(String(128))
+    action: Mapped[Optional[str]] = mapped_column(String(32))  # 'entry', 'partial_exit', 'stop_loss', 'close', ...
+    created_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime, default=datetime.datetime.utcnow)
\ No newline at end of file
@@ -1,73 +1,175 @@
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.pool import QueuePool
 from sqlalchemy.exc import OperationalError
-from sqlalchemy import create_engine
-from models import Position, ProcessedEvent
+from sqlalchemy import create_engine, insert, select, func, bindparam, case
+from models import Position, PositionOrder, ProcessedEvent
 from config import PARTIAL_TP_PERCENTAGE
+from exchange_manager import exchange_manager
 import json
 import time
+from functools import lru_cache
+from contextlib import ExitStack
+import threading
+import weakref
+import random
 import logging
 
-def execute_db_operation_with_retry(func, max_retries=7, delay=0.1):
+# Error message fragments for database locking/concurrency issues worth retrying
+DEADLOCK_MSGS = (
+    "database is locked",
+    "database locked",
+    "lock wait timeout",
+    "deadlock",
+    "too many connections",
+)
+
+def execute_db_operation_with_retry(func, max_retries=7, delay=0.1, engine=None, max_delay=2.0):
     """Execute a database operation with retry logic for database locking errors."""
     for attempt in range(max_retries):
         try:
             return func()
         except OperationalError as e:
-            error_msg = str(e).lower()
-            # Check for various database locking/concurrency issues
-            if ("database is locked" in error_msg or 
-                "database locked" in error_msg or 
-                "lock wait timeout" in error_msg or 
-                "deadlock" in error_msg or
-                "too many connections" in error_msg) and attempt < max_retries - 1:
-                logging.warning(f"Database issue detected in position manager, retrying in {delay}s... (attempt {attempt + 1}/{max_retries})")
-                time.sleep(delay)
-                delay *= 2.5  # Exponential backoff
-            else:
+            # Anything other than a lock/concurrency error will not go away by waiting
+            if attempt >= max_retries - 1:
+                raise
+            error_msg = str(e.orig if e.orig is not None else e).lower()
+            if not any(msg in error_msg for msg in DEADLOCK_MSGS):
                 raise
+            
+            sleep_for = delay * random.uniform(0.8, 1.2)  # Jitter so competing writers don't retry in lockstep
+            logging.warning(f"Database issue detected in position manager, retrying in {sleep_for:.2f}s... (attempt {attempt + 1}/{max_retries})")
+            if engine is not None:
+                logging.warning(f"Connection pool: {engine.pool.status()}")
+            time.sleep(sleep_for)
+            delay = min(delay * 2.5, max_delay)  # Capped exponential backoff
+
+# TP level -> Position column tracking the quantity closed at that level
+_TP_CLOSED_ATTR = {
+    1: 'closed_qty_tp1',
+    2: 'closed_qty_tp2',
+    3: 'closed_qty_tp3',
+    4: 'closed_qty_tp4',
+    5: 'closed_qty_tp5',
+}
+
+# Fraction of the initial quantity closed at each TP level
+_TP_PCT = {1: 0.2, 2: 0.2, 3: 0.2, 4: 0.2, 5: 0.2}
+
+# Stop loss types tracked on the position
+_SL_TYPES = frozenset({'base', 'swing', 'sfp', 'body', 'atr_trail', 'structure_trail', 'chandelier_trail'})
+
+# Generated single-column exit updaters: method suffix -> (Position column tracking the closed quantity, exit type)
+_EXIT_UPDATERS = {
+    'timeguard': ('timeguard_closed_qty', 'TimeGuard'),
+    'maxbars': ('maxbars_closed_qty', 'MaxBars'),
+    'swingtp': ('swingtp_closed_qty', 'SwingTP'),
+    'dyn_tp': ('dyn_tp_closed_qty', 'DynTP'),
+    'other': ('other_closed_qty', 'other'),
+}
+
+# Other exit type -> generated updater (anything else goes to update_after_other)
+_OTHER_EXIT_UPDATER = {exit_type: f'update_after_{name}' for name, (_, exit_type) in _EXIT_UPDATERS.items()}
+
+_positions = Position.__table__
+
+# Statements are built once per shape and reused, so only parameters change between calls
+@lru_cache(maxsize=None)
+def _partial_exit_stmt(tp_level, with_tp_levels=False):
+    """Build the UPDATE for a partial exit at tp_level, executed with b_id/b_qty (and b_tp_levels) parameter sets."""
+    qty = bindparam('b_qty')
+    values = {'remaining_qty': _positions.c.remaining_qty - qty}
+    
+    # Track which TP level was hit
+    if tp_level in _TP_CLOSED_ATTR:
+        closed_col = _positions.c[_TP_CLOSED_ATTR[tp_level]]
+        values[closed_col.name] = closed_col + qty
+    
+    # Update TP level if applicable
+    if tp_level is not None:
+        values['tp_level'] = case((_positions.c.tp_level < tp_level, tp_level), else_=_positions.c.tp_level)
+    else:
+        values['tp_level'] = _positions.c.tp_level + 1
+    
+    # Persist the remaining TP targets in the same statement
+    if with_tp_levels:
+        values['tp_levels'] = bindparam('b_tp_levels')
+    
+    return _positions.update().where(_positions.c.id == bindparam('b_id')).values(**values)
+
+@lru_cache(maxsize=None)
+def _exit_stmt(closed_attr, with_sl_type=False):
+    """Build the UPDATE moving b_qty from remaining_qty into closed_attr, executed with b_id/b_qty (and b_sl_type)."""
+    qty = bindparam('b_qty')
+    remaining = _positions.c.remaining_qty - qty
+    closed_col = _positions.c[closed_attr]
+    values = {
+        'remaining_qty': remaining,
+        closed_attr: closed_col + qty,
+        # If remaining quantity is 0 or less, close the position
+        'status': case((remaining <= 0, 'CLOSED'), else_=_positions.c.status),
+    }
+    if with_sl_type:
+        values['sl_type'] = bindparam('b_sl_type')
+    return _positions.update().where(_positions.c.id == bindparam('b_id')).values(**values)
+
+_close_stmt = (
+    _positions.update()
+    .where(_positions.c.id == bindparam('b_id'))
+    .values(remaining_qty=0, status='CLOSED')
+)
+
+_close_emptied_stmt = (
+    _positions.update()
+    .where(_positions.c.id.in_(bindparam('b_ids', expanding=True)), _positions.c.remaining_qty <= 0)
+    .values(status='CLOSED')
+)
+
+_insert_order_stmt = insert(PositionOrder.__table__)
 
 class PositionManager:
-    def __init__(self, engine):
+    def __init__(self, engine, write_engine=None):
+        write_engine = write_engine if write_engine is not None else engine
+        for eng in {engine, write_engine}:
+            if not isinstance(eng.pool, QueuePool):
+                # e.g. sqlite:///:memory: or NullPool; still usable, just without the ENGINE_KWARGS pool sizing
+                logging.warning(f"⚠️ PositionManager engine uses {type(eng.pool).__name__}, not QueuePool; pool sizing settings do not apply")
         self.engine = engine
-        self.SessionLocal = sessionmaker(bind=engine)
+        self.write_engine = write_engine
+        # Thread-local sessions; objects stay loaded after commit so callers can read them detached
+        self.Session = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
+        self.WriteSession = scoped_session(sessionmaker(bind=write_engine, expire_on_commit=False))
+        # Per-position locks so concurrent exits on one row queue in Python instead of on the database lock
+        self._pos_locks = weakref.WeakValueDictionary()
+        self._pos_locks_guard = threading.Lock()
+    
+    def position_lock(self, pos_id):
+        """Return the lock serializing writes to a position; it is dropped once nobody holds it.
+        
+        Take it before checking out a write connection, and take several in sorted order.
+        """
+        with self._pos_locks_guard:
+            lock = self._pos_locks.get(pos_id)
+            if lock is None:
+                lock = self._pos_locks[pos_id] = threading.Lock()
+            return lock
     
     def get_position(self, account_id, symbol, strategy_id):
         """Retrieve an open position for a given account, symbol, and strategy."""
         def execute_get_position():
-            db = self.SessionLocal()
-            try:
-                pos_id = f"{account_id}_{symbol}_{strategy_id}"
-                pos = db.query(Position).filter(
-                    Position.id == pos_id,
-                    Position.status == 'OPEN'
-                ).first()
+            with self.Session() as db:
+                pos = db.get(Position, f"{account_id}_{symbol}_{strategy_id}")
+                if pos is None or pos.status != 'OPEN':
+                    return None
+                # Detach with its loaded state so callers never trigger a lazy reload
+                db.expunge(pos)
                 return pos
-            finally:
-                db.close()
         
-        return execute_db_operation_with_retry(execute_get_position)
+        return execute_db_operation_with_retry(execute_get_position, engine=self.engine)
     
     def calculate_tp_exit_quantity(self, position, tp_level=None):
         """Calculate quantity for partial take profit exit based on level."""
-        # Default to PARTIAL_TP_PERCENTAGE from config
-        if tp_level is None:
-            return position.initial_qty * PARTIAL_TP_PERCENTAGE
-        
-        # Different TP levels might have different percentages
-        # This can be configured based on strategy requirements
-        if tp_level == 1:
-            return position.initial_qty * 0.2  # 20% for TP1
-        elif tp_level == 2:
-            return position.initial_qty * 0.2  # 20% for TP2
-        elif tp_level == 3:
-            return position.initial_qty * 0.2  # 20% for TP3
-        elif tp_level == 4:
-            return position.initial_qty * 0.2  # 20% for TP4
-        elif tp_level == 5:
-            return position.initial_qty * 0.2  # 20% for TP5
-        else:
-            return position.initial_qty * PARTIAL_TP_PERCENTAGE
+        # Different TP levels might have different percentages, defaulting to PARTIAL_TP_PERCENTAGE from config
+        return position.initial_qty * _TP_PCT.get(tp_level, PARTIAL_TP_PERCENTAGE)
     
     def calculate_sl_exit_quantity(self, position):
         """Calculate quantity for stop loss exit (full close)."""
@@ -75,216 +177,135 @@ class PositionManager:
     
     def update_position_after_partial_exit(self, position, closed_qty, order_id, tp_level=None):
         """Update position after partial exit (e.g., TP1, TP2, etc.)."""
-        def execute_update_partial_exit():
-            db = self.SessionLocal()
-            try:
-                # Get fresh position instance to avoid session issues
-                pos_id = position.id
-                position = db.query(Position).filter(Position.id == pos_id).first()
-                if position is None:
-                    raise ValueError(f"Position {pos_id} not found")
-                    
-                position.remaining_qty -= closed_qty
-                
-                # Track which TP level was hit
-                if tp_level == 1:
-                    position.closed_qty_tp1 += closed_qty
-                elif tp_level == 2:
-                    position.closed_qty_tp2 += closed_qty
-                elif tp_level == 3:
-                    position.closed_qty_tp3 += closed_qty
-                elif tp_level == 4:
-                    position.closed_qty_tp4 += closed_qty
-                elif tp_level == 5:
-                    position.closed_qty_tp5 += closed_qty
-                
-                # Update TP level if applicable
-                if tp_level is not None:
-                    position.tp_level = max(position.tp_level, tp_level)
-                else:
-                    position.tp_level += 1
+        self.apply_partial_exits_bulk([{
+            'position_id': position.id,
+            'closed_qty': closed_qty,
+            'order_id': order_id,
+            'tp_level': tp_level
+        }])
+    
+    def apply_partial_exits_bulk(self, updates):
+        """Apply a batch of partial exits in one transaction.
+        
+        Each update is a dict with position_id, closed_qty, order_id and tp_level keys,
+        plus an optional tp_levels JSON string holding the TP targets still open.
+        """
+        if not updates:
+            return
+        
+        def execute_apply_partial_exits_bulk():
+            with ExitStack() as locks, self.WriteSession() as db, db.begin():
+                # Sorted so two batches touching the same positions can't deadlock
+                for pos_id in sorted({upd['position_id'] for upd in updates}):
+                    locks.enter_context(self.position_lock(pos_id))
+                conn = db.connection()
                 
-                # Update order IDs list
-                order_ids = json.loads(position.order_ids or '[]')
-                order_ids.append(order_id)
-                position.order_ids = json.dumps(order_ids)
+                # One executemany per TP level, since each level bumps a different closed_qty column
+                params_by_level = {}
+                for upd in updates:
+                    params = {'b_id': upd['position_id'], 'b_qty': upd['closed_qty']}
+                    if 'tp_levels' in upd:
+                        params['b_tp_levels'] = upd['tp_levels']
+                    params_by_level.setdefault((upd['tp_level'], 'tp_levels' in upd), []).append(params)
+                for (tp_level, with_tp_levels), params in params_by_level.items():
+                    conn.execute(_partial_exit_stmt(tp_level, with_tp_levels), params)
                 
                 # If remaining quantity is 0 or less, close the position
-                if position.remaining_qty <= 0:
-                    position.status = 'CLOSED'
+                conn.execute(_close_emptied_stmt, {'b_ids': list({upd['position_id'] for upd in updates})})
                 
-                db.commit()
-            except Exception:
-                db.rollback()
-                raise
-            finally:
-                db.close()
+                # Record the exit orders
+                conn.execute(_insert_order_stmt, [
+                    {'position_id': upd['position_id'], 'order_id': upd['order_id'], 'action': 'partial_exit'}
+                    for upd in updates
+                ])
         
-        execute_db_operation_with_retry(execute_update_partial_exit)
+        execute_db_operation_with_retry(execute_apply_partial_exits_bulk, engine=self.write_engine)
     
     def update_position_after_stop_loss(self, position, closed_qty, order_id, sl_type="base"):
         """Update position after stop loss exit with specific SL type."""
         def execute_update_stop_loss():
-            db = self.SessionLocal()
-            try:
-                # Get fresh position instance to avoid session issues
-                pos_id = position.id
-                position = db.query(Position).filter(Position.id == pos_id).first()
-                if position is None:
-                    raise ValueError(f"Position {pos_id} not found")
-                    
-                position.remaining_qty -= closed_qty
-                position.sl_closed_qty += closed_qty
+            pos_id = position.id
+            with self.position_lock(pos_id), self.WriteSession() as db, db.begin():
+                params = {'b_id': pos_id, 'b_qty': closed_qty}
                 
                 # Set stop loss type for tracking purposes
-                if sl_type == "base":
-                    position.sl_type = "base"
-                elif sl_type == "swing":
-                    position.sl_type = "swing"
-                elif sl_type == "sfp":
-                    position.sl_type = "sfp"
-                elif sl_type == "body":
-                    position.sl_type = "body"
-                elif sl_type == "atr_trail":
-                    position.sl_type = "atr_trail"
-                elif sl_type == "structure_trail":
-                    position.sl_type = "structure_trail"
-                elif sl_type == "chandelier_trail":
-                    position.sl_type = "chandelier_trail"
-                
-                # Update order IDs list
-                order_ids = json.loads(position.order_ids or '[]')
-                order_ids.append(order_id)
-                position.order_ids = json.dumps(order_ids)
+                if sl_type in _SL_TYPES:
+                    params['b_sl_type'] = sl_type
                 
-                # If remaining quantity is 0 or less, close the position
-                if position.remaining_qty <= 0:
-                    position.status = 'CLOSED'
+                result = db.execute(_exit_stmt('sl_closed_qty', 'b_sl_type' in params), params)
+                if result.rowcount == 0:
+                    raise ValueError(f"Position {pos_id} not found")
                 
-                db.commit()
-            except Exception:
-                db.rollback()
-                raise
-            finally:
-                db.close()
+                # Record the exit order
+                db.execute(_insert_order_stmt, {'position_id': pos_id, 'order_id': order_id, 'action': "stop_loss"})
         
-        execute_db_operation_with_retry(execute_update_stop_loss)
+        execute_db_operation_with_retry(execute_update_stop_loss, engine=self.write_engine)
     
     def update_position_after_other_exit(self, position, closed_qty, order_id, exit_type="other"):
         """Update position after other exit types (TimeGuard, MaxBars, SwingTP, DynTP, etc.)."""
-        def execute_update_other_exit():
-            db = self.SessionLocal()
-            try:
-                # Get fresh position instance to avoid session issues
-                pos_id = position.id
-                position = db.query(Position).filter(Position.id == pos_id).first()
-                if position is None:
-                    raise ValueError(f"Position {pos_id} not found")
-                    
-                position.remaining_qty -= closed_qty
-                
-                if exit_type == "TimeGuard":
-                    position.timeguard_closed_qty += closed_qty
-                elif exit_type == "MaxBars":
-                    position.maxbars_closed_qty += closed_qty
-                elif exit_type == "SwingTP":
-                    position.swingtp_closed_qty += closed_qty
-                elif exit_type == "DynTP":
-                    position.dyn_tp_closed_qty += closed_qty
-                else:
-                    position.other_closed_qty += closed_qty
-                
-                # Update order IDs list
-                order_ids = json.loads(position.order_ids or '[]')
-                order_ids.append(order_id)
-                position.order_ids = json.dumps(order_ids)
-                
-                # If remaining quantity is 0 or less, close the position
-                if position.remaining_qty <= 0:
-                    position.status = 'CLOSED'
-                
-                db.commit()
-            except Exception:
-                db.rollback()
-                raise
-            finally:
-                db.close()
-        
-        execute_db_operation_with_retry(execute_update_other_exit)
+        updater = getattr(self, _OTHER_EXIT_UPDATER.get(exit_type, 'update_after_other'))
+        updater(position, closed_qty, order_id, action=exit_type)
     
     def close_position(self, position, order_id):
         """Close position completely (set remaining_qty to 0 and status to CLOSED)."""
         def execute_close_position():
-            db = self.SessionLocal()
-            try:
-                # Get fresh position instance to avoid session issues
-                pos_id = position.id
-                position = db.query(Position).filter(Position.id == pos_id).first()
-                if position is None:
+            pos_id = position.id
+            with self.position_lock(pos_id), self.WriteSession() as db, db.begin():
+                result = db.execute(_close_stmt, {'b_id': pos_id})
+                if result.rowcount == 0:
                     raise ValueError(f"Position {pos_id} not found")
-                    
-                position.remaining_qty = 0
-                position.status = 'CLOSED'
                 
-                # Update order IDs list
-                order_ids = json.loads(position.order_ids or '[]')
-                order_ids.append(order_id)
-                position.order_ids = json.dumps(order_ids)
-                
-                db.commit()
-            except Exception:
-                db.rollback()
-                raise
-            finally:
-                db.close()
+                # Record the exit order
+                db.execute(_insert_order_stmt, {'position_id': pos_id, 'order_id': order_id, 'action': "close"})
         
-        execute_db_operation_with_retry(execute_close_position)
+        execute_db_operation_with_retry(execute_close_position, engine=self.write_engine)
     
-    def create_new_position(self, account_id, symbol, strategy_id, side, qty, price, order_id, leverage=None, margin_mode=None, tp_levels=None, sl_price=None):
-        """Create a new position record with additional parameters for Arts One Two Three strategy."""
+    def create_new_position(self, account_id, symbol, strategy_id, side, qty, price, order_id, leverage=None, margin_mode=None, tp_levels=None, sl_price=None, db=None):
+        """Create a new position record with additional parameters for Arts One Two Three strategy.
+        
+        When db is given the rows are added to that session and the caller commits them; a caller
+        already holding the single write connection must pass its session here.
+        """
+        pos_id = f"{account_id}_{symbol}_{strategy_id}"
+        
+        def add_position(session):
+            new_pos = Position(
+                id=pos_id,
+                account_id=account_id,
+                symbol=symbol,
+                strategy_id=strategy_id,
+                side=side,
+                initial_qty=qty,
+                remaining_qty=qty,
+                entry_price=price,
+                leverage=leverage,
+                margin_mode=margin_mode,
+                tp_levels=json.dumps(tp_levels) if tp_levels else None,
+                sl_price=sl_price
+            )
+            session.add(new_pos)
+            session.add(PositionOrder(position_id=pos_id, order_id=order_id, action="entry"))
+            return new_pos
+        
+        if db is not None:
+            return add_position(db)
+        
         def execute_create_position():
-            db = self.SessionLocal()
-            try:
-                pos_id = f"{account_id}_{symbol}_{strategy_id}"
-                new_pos = Position(
-                    id=pos_id,
-                    account_id=account_id,
-                    symbol=symbol,
-                    strategy_id=strategy_id,
-                    side=side,
-                    initial_qty=qty,
-                    remaining_qty=qty,
-                    entry_price=price,
-                    order_ids=json.dumps([order_id]),
-                    leverage=leverage,
-                    margin_mode=margin_mode,
-                    tp_levels=json.dumps(tp_levels) if tp_levels else None,
-                    sl_price=sl_price
-                )
-                db.add(new_pos)
-                db.commit()
-                return new_pos
-            except Exception:
-                db.rollback()
-                raise
-            finally:
-                db.close()
+            with self.WriteSession() as session, session.begin():
+                return add_position(session)
         
-        return execute_db_operation_with_retry(execute_create_position)
+        return execute_db_operation_with_retry(execute_create_position, engine=self.write_engine)
     
     def get_active_positions_count(self, account_id=None):
         """Get count of active (OPEN) positions."""
         def execute_get_active_positions_count():
-            db = self.SessionLocal()
-            try:
-                query = db.query(Position).filter(Position.status == 'OPEN')
+            with self.Session() as db:
+                stmt = select(func.count(Position.id)).where(Position.status == 'OPEN')
                 if account_id:
-                    query = query.filter(Position.account_id == account_id)
-                return query.count()
-            finally:
-                db.close()
+                    stmt = stmt.where(Position.account_id == account_id)
+                return db.execute(stmt).scalar_one()
         
-        return execute_db_operation_with_retry(execute_get_active_positions_count)
+        return execute_db_operation_with_retry(execute_get_active_positions_count, engine=self.engine)
     
     def update_tp_level(self, position, level):
         """Update the current TP level for the position."""
@@ -293,8 +314,7 @@ class PositionManager:
     def get_position_summary(self, account_id=None, symbol=None, strategy_id=None):
         """Get a comprehensive summary of positions with detailed metrics."""
         def execute_get_position_summary():
-            db = self.SessionLocal()
-            try:
+            with self.Session() as db:
                 query = db.query(Position)
                 
                 # Apply filters if provided
@@ -307,17 +327,24 @@ class PositionManager:
                 
                 positions = query.all()
                 
+                # One ticker request per account covering all of its symbols
+                symbols_by_account = {}
+                for pos in positions:
+                    if pos.entry_price:
+                        symbols_by_account.setdefault(pos.account_id, set()).add(pos.symbol)
+                prices = {account: self._get_current_prices(account, symbols) for account, symbols in symbols_by_account.items()}
+                
                 summary = []
                 for pos in positions:
                     # Calculate PnL percentage
                     if pos.entry_price:
-                        current_price = self._get_current_price(pos.symbol)  # You'd need to implement this
+                        current_price = prices[pos.account_id].get(pos.symbol)
                         pnl_pct = ((current_price - pos.entry_price) / pos.entry_price) * 100 if current_price else 0
                         if pos.side == 'sell':  # Short position
                             pnl_pct = -pnl_pct
                     else:
                         pnl_pct = 0
-                    
+                
                     pos_summary = {
                         'id': pos.id,
                         'account_id': pos.account_id,
@@ -349,16 +376,14 @@ class PositionManager:
                     summary.append(pos_summary)
                 
                 return summary
-            finally:
-                db.close()
         
-        return execute_db_operation_with_retry(execute_get_position_summary)
+        return execute_db_operation_with_retry(execute_get_position_summary, engine=self.engine)
     
-    def _get_current_price(self, symbol):
-        """Helper method to get current price (would integrate with exchange manager)."""
-        # This would need to be implemented to fetch real-time prices
-        # from the exchange manager for PnL calculations
-        return None
+    def _get_current_prices(self, account_id, symbols):
+        """Helper method to get current prices for an account's symbols, empty if the account is not configured."""
+        if account_id not in exchange_manager.exchange_configs:
+            return {}
+        return exchange_manager.get_last_prices(account_id, symbols)
     
     def calculate_remaining_tp_percent(self, position):
         """Calculate the percentage of position that still needs to be closed via TP."""
@@ -366,4 +391,28 @@ class PositionManager:
                        position.closed_qty_tp3 + position.closed_qty_tp4 + 
                        position.closed_qty_tp5)
         remaining_for_tp = position.initial_qty - total_closed - position.sl_closed_qty - position.other_closed_qty
-        return (remaining_for_tp / position.initial_qty) * 100 if position.initial_qty > 0 else 0
\ No newline at end of file
+        return (remaining_for_tp / position.initial_qty) * 100 if position.initial_qty > 0 else 0
+
+
+def _make_exit_updater(closed_attr, exit_type):
+    """Build a PositionManager method bound to the prebuilt UPDATE for one closed_qty column."""
+    stmt = _exit_stmt(closed_attr)
+    
+    def updater(self, position, closed_qty, order_id, action=exit_type):
+        def execute_update_exit():
+            pos_id = position.id
+            with self.position_lock(pos_id), self.WriteSession() as db, db.begin():
+                result = db.execute(stmt, {'b_id': pos_id, 'b_qty': closed_qty})
+                if result.rowcount == 0:
+                    raise ValueError(f"Position {pos_id} not found")
+                
+                # Record the exit order
+                db.execute(_insert_order_stmt, {'position_id': pos_id, 'order_id': order_id, 'action': action})
+        
+        execute_db_operation_with_retry(execute_update_exit, engine=self.write_engine)
+    
+    updater.__doc__ = f"Update position after a {exit_type} exit, adding the closed quantity to {closed_attr}."
+    return updater
+
+for _name, (_closed_attr, _exit_type) in _EXIT_UPDATERS.items():
+    setattr(PositionManager, f'update_after_{_name}', _make_exit_updater(_closed_attr, _exit_type))
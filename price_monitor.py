@@ -4,13 +4,17 @@ Monitors prices and triggers take-profit orders for Mode A
 """
 import asyncio
 import threading
+from bisect import bisect_left, bisect_right
 from typing import Dict, List, Optional
-from exchange_manager import exchange_manager
+from exchange_manager import exchange_manager, get_order_id
 from models import Position
 from position_manager import PositionManager
 from sqlalchemy.orm import sessionmaker
 import time
 import json
+import logging
+
+log = logging.getLogger(__name__)
 
 
 class PriceMonitor:
@@ -24,130 +28,212 @@ class PriceMonitor:
         self.SessionLocal = sessionmaker(bind=engine)
         self.position_manager = position_manager
         self.active_monitors = {}  # Maps (account_id, symbol) to monitor info
+        self.symbol_index = {}  # Maps (exchange, symbol) to the set of active_monitors keys sharing that price
+        self.symbol_triggers = {}  # Maps (exchange, symbol) to (lowest long TP price, highest short TP price)
+        self._index_lock = threading.Lock()  # Webhook handlers register positions while a tick reads in the executor
+        self._failed_exits = []  # Filled TP exits whose database update failed, retried on the next tick
         self.running = False
-        self.monitor_thread = None
-        
-    def start_monitoring(self):
-        """Start the price monitoring thread"""
-        if not self.running:
-            self.running = True
-            self.monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True)
-            self.monitor_thread.start()
-            print("✅ Price Monitor started")
+    
+    async def run(self):
+        """Main monitoring loop, run as a task on the application's event loop"""
+        if self.running:
+            return
+        self.running = True
+        log.info("✅ Price Monitor started")
+        while self.running:
+            try:
+                # Exchange clients are blocking, so each tick runs in the loop's default executor
+                await asyncio.to_thread(self._check_prices)
+                await asyncio.sleep(1)  # Check every second
+            except asyncio.CancelledError:
+                self.running = False
+                raise
+            except Exception as e:
+                log.error("❌ Error in price monitor: %s", e)
+                await asyncio.sleep(5)  # Wait longer if there's an error
     
     def stop_monitoring(self):
-        """Stop the price monitoring thread"""
+        """Stop the price monitoring loop after its current tick"""
         self.running = False
-        if self.monitor_thread:
-            self.monitor_thread.join()
-        print("✅ Price Monitor stopped")
+        log.info("✅ Price Monitor stopped")
     
     def add_position_to_monitor(self, account_id: str, symbol: str, position: Position):
         """Add a position to be monitored for take-profit levels"""
         if position.tp_levels:
             try:
                 tp_levels = json.loads(position.tp_levels) if isinstance(position.tp_levels, str) else position.tp_levels
-                if tp_levels:
+                # Parse TP targets and level numbers (TP1 -> 1, TP2 -> 2, etc.) once,
+                # sorted by price so a tick can slice out the triggered range
+                tp_entries = sorted(
+                    (float(tp_details['price']), float(tp_details['percent']), tp_level_name,
+                     int(tp_level_name[2:]) if tp_level_name.startswith('TP') else None)
+                    for tp_level_name, tp_details in tp_levels.items()
+                    if isinstance(tp_details, dict) and 'price' in tp_details and 'percent' in tp_details
+                ) if tp_levels else []
+                if tp_entries:
                     key = (account_id, symbol)
-                    self.active_monitors[key] = {
-                        'position': position,
-                        'tp_levels': tp_levels,
-                        'side': position.side,
-                        'last_checked': time.time()
-                    }
-                    print(f"✅ Added {symbol} position to price monitor for account {account_id}")
-            except json.JSONDecodeError:
-                print(f"⚠️ Invalid TP levels JSON for {symbol} position")
+                    price_key = (exchange_manager.get_exchange_config(account_id)['exchange'].lower(), symbol)
+                    with self._index_lock:
+                        self.active_monitors[key] = {
+                            'position': position,
+                            'tp_levels': tp_levels,
+                            'tp_prices': [entry[0] for entry in tp_entries],
+                            'tp_entries': tp_entries,
+                            'side': position.side,
+                            'price_key': price_key,
+                            'last_checked': time.time()
+                        }
+                        self.symbol_index.setdefault(price_key, set()).add(key)
+                        self._refresh_triggers(price_key)
+                    log.debug("✅ Added %s position to price monitor for account %s", symbol, account_id)
+            except (json.JSONDecodeError, TypeError, ValueError):
+                log.warning("⚠️ Invalid TP levels JSON for %s position", symbol)
     
     def remove_position_from_monitor(self, account_id: str, symbol: str):
         """Remove a position from monitoring"""
         key = (account_id, symbol)
-        if key in self.active_monitors:
-            del self.active_monitors[key]
-            print(f"✅ Removed {symbol} from price monitor for account {account_id}")
+        with self._index_lock:
+            monitor_info = self.active_monitors.pop(key, None)
+            if monitor_info is not None:
+                keys = self.symbol_index.get(monitor_info['price_key'])
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.symbol_index[monitor_info['price_key']]
+                self._refresh_triggers(monitor_info['price_key'])
+        if monitor_info is not None:
+            log.debug("✅ Removed %s from price monitor for account %s", symbol, account_id)
     
-    def _monitor_loop(self):
-        """Main monitoring loop that runs in a separate thread"""
-        while self.running:
-            try:
-                self._check_prices()
-                time.sleep(1)  # Check every second
-            except Exception as e:
-                print(f"❌ Error in price monitor: {str(e)}")
-                time.sleep(5)  # Wait longer if there's an error
+    def _refresh_triggers(self, price_key):
+        """Recompute the nearest TP prices on either side for a symbol (caller holds _index_lock)"""
+        keys = self.symbol_index.get(price_key)
+        if not keys:
+            self.symbol_triggers.pop(price_key, None)
+            return
+        
+        long_trigger, short_trigger = float('inf'), float('-inf')
+        for key in keys:
+            monitor_info = self.active_monitors[key]
+            tp_prices = monitor_info['tp_prices']
+            if not tp_prices:
+                continue
+            if monitor_info['side'] == 'buy':
+                long_trigger = min(long_trigger, tp_prices[0])
+            elif monitor_info['side'] == 'sell':
+                short_trigger = max(short_trigger, tp_prices[-1])
+        self.symbol_triggers[price_key] = (long_trigger, short_trigger)
     
     def _check_prices(self):
         """Check current prices against TP levels for all monitored positions"""
-        for (account_id, symbol), monitor_info in list(self.active_monitors.items()):
+        # Partial exits filled during this tick, written to the database in one batch at the end,
+        # after any the previous tick could not write (their orders are already on the exchange)
+        pending_exits, self._failed_exits = self._failed_exits, []
+        
+        with self._index_lock:
+            price_groups = [
+                (price_key, list(keys), self.symbol_triggers[price_key])
+                for price_key, keys in self.symbol_index.items()
+            ]
+        
+        for (exchange, symbol), keys, (long_trigger, short_trigger) in price_groups:
+            # Fetch the price once per exchange symbol and fan it out to every position on it
+            try:
+                current_price = exchange_manager.get_last_price(keys[0][0], symbol)
+            except Exception as e:
+                log.error("❌ Error fetching %s price for %s: %s", exchange.upper(), symbol, e)
+                continue
+            if current_price is None:
+                continue
+            
+            # Nothing on this symbol can fire unless the price reached the nearest long or short target
+            if short_trigger < current_price < long_trigger:
+                continue
+            
+            for account_id, _ in keys:
+                monitor_info = self.active_monitors.get((account_id, symbol))
+                if monitor_info is not None:
+                    self._check_position(account_id, symbol, monitor_info, current_price, pending_exits)
+        
+        # Update positions in database
+        if pending_exits:
             try:
-                # Get current price
-                current_price = exchange_manager.get_last_price(account_id, symbol)
-                if current_price is None:
-                    continue
+                self.position_manager.apply_partial_exits_bulk(pending_exits)
+            except Exception as e:
+                # The batch is one transaction, so nothing was applied; keep all of it for the next tick
+                self._failed_exits = pending_exits
+                log.error("❌ Failed to update %d position(s) after TP exits, retrying next tick: %s", len(pending_exits), e)
+    
+    def _check_position(self, account_id, symbol, monitor_info, current_price, pending_exits):
+        """Check one monitored position against the current price, queueing any filled TP exits"""
+        try:
+            position = monitor_info['position']
+            tp_levels = monitor_info['tp_levels']
+            tp_prices = monitor_info['tp_prices']  # ascending
+            position_side = monitor_info['side']  # 'buy' or 'sell'
+            
+            # For long positions (buy), trigger every TP at or below the price
+            # For short positions (sell), trigger every TP at or above the price
+            if position_side == 'buy':
+                start, stop = 0, bisect_right(tp_prices, current_price)
+            elif position_side == 'sell':
+                start, stop = bisect_left(tp_prices, current_price), len(tp_prices)
+            else:
+                return
+            if start == stop:
+                return
+            
+            filled = set()
+            queued = []
+            for tp_price, tp_percent, tp_level_name, tp_num in monitor_info['tp_entries'][start:stop]:
+                # Calculate quantity to close based on percentage
+                close_qty = position.initial_qty * tp_percent
                 
-                position = monitor_info['position']
-                tp_levels = monitor_info['tp_levels']
-                position_side = monitor_info['side']  # 'buy' or 'sell'
+                # Execute take profit order
+                try:
+                    exit_side = 'sell' if position_side == 'buy' else 'buy'
+                    
+                    order = exchange_manager.execute_market_close(
+                        account_id=account_id,
+                        symbol=symbol,
+                        side=exit_side,
+                        qty=close_qty
+                    )
+                    
+                    # Queue the position update for the end-of-tick batch
+                    queued.append({
+                        'position_id': position.id,
+                        'closed_qty': close_qty,
+                        'order_id': get_order_id(order),
+                        'tp_level': tp_num
+                    })
+                    
+                    # Remove the triggered TP level from monitoring
+                    del tp_levels[tp_level_name]
+                    filled.add(tp_level_name)
+                    
+                    log.debug("✅ %s hit for %s at $%s. Closed %s units.", tp_level_name, symbol, tp_price, close_qty)
+                    
+                except Exception as order_error:
+                    log.error("❌ Failed to execute %s order for %s: %s", tp_level_name, symbol, order_error)
+            
+            if filled:
+                # Every exit queued this tick carries the final TP set, so the batch persists it whatever order it runs in
+                remaining_tp_levels = json.dumps(tp_levels) if tp_levels else None
+                for exit_update in queued:
+                    exit_update['tp_levels'] = remaining_tp_levels
+                pending_exits.extend(queued)
                 
-                # Check if any TP levels have been hit
-                for tp_level_name, tp_details in list(tp_levels.items()):
-                    if isinstance(tp_details, dict) and 'price' in tp_details and 'percent' in tp_details:
-                        tp_price = float(tp_details['price'])
-                        tp_percent = float(tp_details['percent'])
-                        
-                        # For long positions (buy), trigger TP when price >= TP price
-                        # For short positions (sell), trigger TP when price <= TP price
-                        tp_triggered = False
-                        if position_side == 'buy' and current_price >= tp_price:
-                            tp_triggered = True
-                        elif position_side == 'sell' and current_price <= tp_price:
-                            tp_triggered = True
-                        
-                        if tp_triggered:
-                            # Calculate quantity to close based on percentage
-                            close_qty = position.initial_qty * tp_percent
-                            
-                            # Execute take profit order
-                            try:
-                                exit_side = 'sell' if position_side == 'buy' else 'buy'
-                                
-                                order = exchange_manager.execute_order(
-                                    account_id=account_id,
-                                    symbol=symbol,
-                                    side=exit_side,
-                                    qty=close_qty,
-                                    reduce_only=True,
-                                    order_type="MARKET"
-                                )
-                                
-                                # Parse TP level number (e.g., TP1 -> 1, TP2 -> 2, etc.)
-                                tp_num = int(tp_level_name.replace('TP', '')) if tp_level_name.startswith('TP') else None
-                                
-                                # Update position in database
-                                self.position_manager.update_position_after_partial_exit(
-                                    position, 
-                                    close_qty, 
-                                    order.get('orderId', order.get('result', {}).get('orderId')), 
-                                    tp_level=tp_num
-                                )
-                                
-                                # Remove the triggered TP level from monitoring
-                                del tp_levels[tp_level_name]
-                                
-                                print(f"✅ {tp_level_name} hit for {symbol} at ${tp_price}. Closed {close_qty} units.")
-                                
-                                # Update the position's TP levels in DB
-                                position.tp_levels = json.dumps(tp_levels) if tp_levels else None
-                                
-                                # If no more TP levels, remove from monitoring
-                                if not tp_levels:
-                                    self.remove_position_from_monitor(account_id, symbol)
-                                
-                            except Exception as order_error:
-                                print(f"❌ Failed to execute {tp_level_name} order for {symbol}: {str(order_error)}")
-                                
-            except Exception as e:
-                print(f"❌ Error checking price for {symbol} on {account_id}: {str(e)}")
+                monitor_info['tp_entries'] = [entry for entry in monitor_info['tp_entries'] if entry[2] not in filled]
+                monitor_info['tp_prices'] = [entry[0] for entry in monitor_info['tp_entries']]
+                with self._index_lock:
+                    self._refresh_triggers(monitor_info['price_key'])
+                
+                # If no more TP levels, remove from monitoring
+                if not monitor_info['tp_entries']:
+                    self.remove_position_from_monitor(account_id, symbol)
+        
+        except Exception as e:
+            log.error("❌ Error checking price for %s on %s: %s", symbol, account_id, e)
     
     def get_monitoring_status(self) -> Dict:
         """Get current status of price monitoring"""
@@ -162,9 +248,8 @@ class PriceMonitor:
 price_monitor = None
 
 def init_price_monitor(engine, position_manager):
-    """Initialize the price monitor"""
+    """Initialize the price monitor; the caller schedules price_monitor.run() on its event loop"""
     global price_monitor
     if price_monitor is None:
         price_monitor = PriceMonitor(engine, position_manager)
-        price_monitor.start_monitoring()
     return price_monitor
\ No newline at end of file
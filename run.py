@@ -12,6 +12,14 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+def _fastest_available(module_name, fallback):
+    """Return module_name if it can be imported, otherwise the uvicorn fallback implementation."""
+    try:
+        __import__(module_name)
+        return module_name
+    except ImportError:
+        return fallback
+
 def main():
     print("🚀 Starting Arts Trading Bot...")
     print("✅ Loading configuration...")
@@ -24,13 +32,22 @@ def main():
     print("💡 Press Ctrl+C to stop the server")
     print("-" * 50)
     
+    # uvloop is not available on Windows; fall back to the stock asyncio loop and h11 parser there
+    loop = _fastest_available("uvloop", "asyncio")
+    http = _fastest_available("httptools", "h11")
+    limit_concurrency = os.getenv("LIMIT_CONCURRENCY")
+    
     try:
         # Run the FastAPI application with uvicorn
         uvicorn.run(
             "main:app",  # module:app
             host=host,
             port=port,
-            reload=os.getenv("RELOAD", "false").lower() == "true",  # Enable auto-reload in development
+            loop=loop,
+            http=http,
+            backlog=2048,
+            limit_concurrency=int(limit_concurrency) if limit_concurrency else None,  # Bound concurrent webhook load
+            reload=os.getenv("RELOAD", "false").lower() == "true" and os.getenv("ENVIRONMENT") != "production",  # Enable auto-reload in development
             log_level=os.getenv("LOG_LEVEL", "info"),
             workers=int(os.getenv("WORKERS", "1"))  # Number of worker processes
         )
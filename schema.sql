@@ -30,7 +30,6 @@ CREATE TABLE IF NOT EXISTS positions (
     dyn_tp_closed_qty DECIMAL(20, 8) DEFAULT 0.0,     -- Quantity closed by DynTP
     other_closed_qty DECIMAL(20, 8) DEFAULT 0.0,      -- Quantity closed by other means
     entry_price DECIMAL(20, 8),
-    order_ids TEXT, -- JSON string list of order IDs
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     leverage INTEGER DEFAULT 1,
     margin_mode VARCHAR(20) DEFAULT 'cross', -- 'cross' or 'isolated'
@@ -40,11 +39,75 @@ CREATE TABLE IF NOT EXISTS positions (
     entry_strategy VARCHAR(20) DEFAULT 'sfp' -- Entry strategy: sfp, volume_spike, etc.
 );
 
+-- Table for storing the exchange orders placed against each position
+CREATE TABLE IF NOT EXISTS position_orders (
+    id SERIAL PRIMARY KEY,
+    position_id VARCHAR(255) REFERENCES positions(id),
+    order_id VARCHAR(128),
+    action VARCHAR(32), -- 'entry', 'partial_exit', 'stop_loss', 'close', ...
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Migration: order ids moved from positions.order_ids (JSON list) to position_orders.
+-- Existing ids are copied over as 'legacy' rows one position at a time, so a malformed value
+-- is reported and skipped instead of aborting the migration. The column is dropped only once
+-- every position was copied and the inserted row count matches; otherwise it is kept for
+-- manual repair; positions that already have 'legacy' rows are not copied twice on a re-run
+DO $$
+DECLARE
+    legacy RECORD;
+    inserted INTEGER;
+    copied INTEGER := 0;
+    expected INTEGER := 0;
+    skipped INTEGER := 0;
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'positions' AND column_name = 'order_ids'
+    ) THEN
+        FOR legacy IN
+            SELECT p.id, p.order_ids FROM positions p
+            WHERE p.order_ids IS NOT NULL AND p.order_ids <> ''
+              AND NOT EXISTS (
+                  SELECT 1 FROM position_orders po
+                  WHERE po.position_id = p.id AND po.action = 'legacy'
+              )
+        LOOP
+            BEGIN
+                IF json_typeof(legacy.order_ids::json) = 'array' THEN
+                    INSERT INTO position_orders (position_id, order_id, action)
+                    SELECT legacy.id, json_array_elements_text(legacy.order_ids::json), 'legacy';
+                    GET DIAGNOSTICS inserted = ROW_COUNT;
+                    copied := copied + inserted;
+                    expected := expected + json_array_length(legacy.order_ids::json);
+                ELSE
+                    skipped := skipped + 1;
+                    RAISE WARNING 'order_ids of position % is not a JSON array, not migrated', legacy.id;
+                END IF;
+            EXCEPTION WHEN invalid_text_representation THEN
+                skipped := skipped + 1;
+                RAISE WARNING 'order_ids of position % is not valid JSON, not migrated', legacy.id;
+            END;
+        END LOOP;
+        
+        IF skipped = 0 AND copied = expected THEN
+            ALTER TABLE positions DROP COLUMN order_ids;
+        ELSE
+            RAISE WARNING 'Kept positions.order_ids: % position(s) skipped, % of % order id(s) copied',
+                skipped, copied, expected;
+        END IF;
+    END IF;
+END
+$$;
+
 -- Indexes for better query performance
 CREATE INDEX IF NOT EXISTS idx_positions_account_status ON positions(account_id, status);
 CREATE INDEX IF NOT EXISTS idx_positions_symbol_strategy ON positions(symbol, strategy_id);
 CREATE INDEX IF NOT EXISTS idx_positions_status ON positions(status);
+CREATE INDEX IF NOT EXISTS ix_position_status_account ON positions(status, account_id);
+CREATE INDEX IF NOT EXISTS ix_position_open ON positions(account_id, symbol, strategy_id) WHERE status = 'OPEN';
 CREATE INDEX IF NOT EXISTS idx_processed_events_timestamp ON processed_events(timestamp);
+CREATE INDEX IF NOT EXISTS idx_position_orders_position_id ON position_orders(position_id);
 
 -- Trigger to update the updated_at timestamp in PostgreSQL
 CREATE OR REPLACE FUNCTION update_updated_at_column()
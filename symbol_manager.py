@@ -2,9 +2,30 @@
 Symbol Manager for Arts One Two Three Automated Trading Bot
 Handles auto-fetch of tradeable instruments and allowlist/denylist per strategy
 """
-from typing import List, Dict, Optional, Set
+from typing import List, Dict, Optional, Set, FrozenSet
 from exchange_manager import exchange_manager
-import re
+import sys
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from itertools import islice
+
+
+@dataclass(slots=True)
+class SymbolMeta:
+    """
+    Trading metadata for a symbol; defaults apply until real values are fetched
+    """
+    symbol: str
+    account_id: str
+    tradable: bool = True
+    min_notional: float = 5.0  # Default min notional
+    tick_size: float = 0.1     # Default tick size
+    lot_size: float = 0.001    # Default lot size
+    volume_24h: float = 0      # Will be updated periodically
+    price_precision: int = 1   # Decimal places for price
+    quantity_precision: int = 3  # Decimal places for quantity
 
 
 class SymbolManager:
@@ -16,12 +37,21 @@ class SymbolManager:
     """
     
     def __init__(self):
-        self.available_symbols = {}  # exchange -> list of symbols
+        self.available_symbols = {}  # account_exchange -> frozenset of symbols
+        self._valid_symbols = {}  # account_id -> frozenset of format-valid symbols, filtered once per fetch
+        self._all_symbols = None  # union of _valid_symbols, rebuilt lazily after a fetch
         self.strategy_allowlists = {}  # strategy_id -> set of allowed symbols
         self.strategy_denylists = {}  # strategy_id -> set of denied symbols
-        self.symbol_metadata = {}  # symbol -> metadata dict
+        self.symbol_metadata = {}  # symbol -> SymbolMeta
+        # Symbols by descending 24h volume, with a parallel array of negated volumes (ascending, for bisect);
+        # rebuilt lazily after new metadata arrives
+        self._volume_symbols = None
+        self._volume_keys = None
+        self._allow_cache = {}  # (symbol, strategy_id, account_id) -> bool, cleared when a strategy list changes
+        # Account-level allow decisions are shared by every strategy, so they get their own bounded cache
+        self._account_allow_cache = lru_cache(maxsize=65536)(self._is_symbol_allowed_for_account)
     
-    def fetch_available_symbols(self, account_id: str, force_refresh: bool = False) -> List[str]:
+    def fetch_available_symbols(self, account_id: str, force_refresh: bool = False) -> FrozenSet[str]:
         """
         Fetch available symbols from the exchange for a given account
         """
@@ -34,140 +64,186 @@ class SymbolManager:
         if not force_refresh and cache_key in self.available_symbols:
             return self.available_symbols[cache_key]
         
-        # Fetch symbols from exchange
-        symbols = exchange_manager.get_available_symbols(account_id)
+        # Fetch symbols from exchange, interned so every structure shares one string object per symbol
+        symbols = frozenset(map(sys.intern, exchange_manager.get_available_symbols(account_id)))
         
         # Cache the results
         self.available_symbols[cache_key] = symbols
+        self._valid_symbols[account_id] = frozenset(filter(self.is_symbol_valid, symbols))
+        self._all_symbols = None
         
         # Update metadata for fetched symbols
         self._update_symbol_metadata(account_id, symbols)
         
         return symbols
     
-    def _update_symbol_metadata(self, account_id: str, symbols: List[str]):
+    def _update_symbol_metadata(self, account_id: str, symbols: FrozenSet[str]):
         """
         Update metadata for the given symbols
         """
         # This is a simplified version - in a production system, you'd fetch
         # detailed metadata like tick size, lot size, min notional, etc.
-        for symbol in symbols:
-            if symbol not in self.symbol_metadata:
-                self.symbol_metadata[symbol] = {
-                    'symbol': symbol,
-                    'account_id': account_id,
-                    'tradable': True,
-                    'min_notional': 5.0,  # Default min notional
-                    'tick_size': 0.1,     # Default tick size
-                    'lot_size': 0.001,    # Default lot size
-                    'volume_24h': 0,      # Will be updated periodically
-                    'price_precision': 1,  # Decimal places for price
-                    'quantity_precision': 3  # Decimal places for quantity
-                }
+        new_symbols = symbols - self.symbol_metadata.keys()
+        for symbol in new_symbols:
+            self.symbol_metadata[symbol] = SymbolMeta(symbol, account_id)
+        if new_symbols:
+            self._volume_symbols = self._volume_keys = None
     
     def is_symbol_valid(self, symbol: str) -> bool:
         """
         Check if a symbol is valid (format-wise)
         """
         # Basic validation: should be in format like BTCUSDT, ETHUSDT, etc.
-        # Should have at least 3 chars for base currency and 3 for quote currency
-        pattern = r'^[A-Z]{3,}[A-Z]{3,}$'
-        return bool(re.match(pattern, symbol))
+        # Should have at least 3 chars for base currency and 3 for quote currency, using ASCII
+        # uppercase letters and digits (1000PEPEUSDT); isupper() also requires at least one letter
+        return len(symbol) >= 6 and symbol.isascii() and symbol.isalnum() and symbol.isupper()
     
     def is_symbol_allowed_for_strategy(self, symbol: str, strategy_id: str, account_id: str = None) -> bool:
         """
         Check if a symbol is allowed for a specific strategy
         """
-        # First check if symbol is valid
-        if not self.is_symbol_valid(symbol):
+        cache_key = (symbol, strategy_id, account_id)
+        allowed = self._allow_cache.get(cache_key)
+        if allowed is None:
+            allowed = self._allow_cache[cache_key] = self._compute_symbol_allowed(symbol, strategy_id, account_id)
+        return allowed
+    
+    def _compute_symbol_allowed(self, symbol: str, strategy_id: str, account_id: str = None) -> bool:
+        """
+        Uncached allow decision behind is_symbol_allowed_for_strategy
+        """
+        # Cheapest and most selective checks first: set lookups reject most symbols
+        # before the account filter or format validation run
+        
+        # Check strategy-specific denylist (only non-empty lists are stored)
+        denylist = self.strategy_denylists.get(strategy_id)
+        if denylist is not None and symbol in denylist:
             return False
         
         # Check strategy-specific allowlist
-        if strategy_id in self.strategy_allowlists:
-            allowlist = self.strategy_allowlists[strategy_id]
-            if allowlist and symbol not in allowlist:
-                return False
-        
-        # Check strategy-specific denylist
-        if strategy_id in self.strategy_denylists:
-            denylist = self.strategy_denylists[strategy_id]
-            if denylist and symbol in denylist:
-                return False
+        allowlist = self.strategy_allowlists.get(strategy_id)
+        if allowlist is not None and symbol not in allowlist:
+            return False
         
         # If account_id is provided, also check account-specific filters
-        if account_id:
-            from account_config import account_config_manager
-            if not account_config_manager.is_symbol_allowed(account_id, symbol):
-                return False
+        if account_id and not self._account_allow_cache(account_id, symbol):
+            return False
         
-        return True
+        # Finally check that the symbol is valid format-wise
+        return self.is_symbol_valid(symbol)
+    
+    @staticmethod
+    def _is_symbol_allowed_for_account(account_id: str, symbol: str) -> bool:
+        """
+        Uncached account-level allow decision behind _account_allow_cache
+        """
+        from account_config import account_config_manager
+        return account_config_manager.is_symbol_allowed(account_id, symbol)
+    
+    def clear_account_cache(self):
+        """
+        Drop cached allow decisions after account symbol filters change
+        """
+        self._account_allow_cache.cache_clear()
+        self._allow_cache.clear()
     
     def set_strategy_allowlist(self, strategy_id: str, symbols: List[str]):
         """
         Set the allowlist for a specific strategy
         """
-        self.strategy_allowlists[strategy_id] = set(symbols)
+        # Empty lists impose no restriction, so they are not stored at all
+        if symbols:
+            self.strategy_allowlists[strategy_id] = set(map(sys.intern, symbols))
+        else:
+            self.strategy_allowlists.pop(strategy_id, None)
+        self._allow_cache.clear()
     
     def set_strategy_denylist(self, strategy_id: str, symbols: List[str]):
         """
         Set the denylist for a specific strategy
         """
-        self.strategy_denylists[strategy_id] = set(symbols)
+        # Empty lists impose no restriction, so they are not stored at all
+        if symbols:
+            self.strategy_denylists[strategy_id] = set(map(sys.intern, symbols))
+        else:
+            self.strategy_denylists.pop(strategy_id, None)
+        self._allow_cache.clear()
     
     def add_to_strategy_allowlist(self, strategy_id: str, symbols: List[str]):
         """
         Add symbols to the allowlist for a specific strategy
         """
-        if strategy_id not in self.strategy_allowlists:
-            self.strategy_allowlists[strategy_id] = set()
-        self.strategy_allowlists[strategy_id].update(symbols)
+        if symbols:
+            self.strategy_allowlists.setdefault(strategy_id, set()).update(map(sys.intern, symbols))
+            self._allow_cache.clear()
     
     def remove_from_strategy_allowlist(self, strategy_id: str, symbols: List[str]):
         """
         Remove symbols from the allowlist for a specific strategy
         """
-        if strategy_id in self.strategy_allowlists:
-            for symbol in symbols:
-                self.strategy_allowlists[strategy_id].discard(symbol)
+        allowlist = self.strategy_allowlists.get(strategy_id)
+        if allowlist is not None:
+            allowlist.difference_update(symbols)
+            if not allowlist:
+                del self.strategy_allowlists[strategy_id]
+            self._allow_cache.clear()
     
     def add_to_strategy_denylist(self, strategy_id: str, symbols: List[str]):
         """
         Add symbols to the denylist for a specific strategy
         """
-        if strategy_id not in self.strategy_denylists:
-            self.strategy_denylists[strategy_id] = set()
-        self.strategy_denylists[strategy_id].update(symbols)
+        if symbols:
+            self.strategy_denylists.setdefault(strategy_id, set()).update(map(sys.intern, symbols))
+            self._allow_cache.clear()
     
     def remove_from_strategy_denylist(self, strategy_id: str, symbols: List[str]):
         """
         Remove symbols from the denylist for a specific strategy
         """
-        if strategy_id in self.strategy_denylists:
-            for symbol in symbols:
-                self.strategy_denylists[strategy_id].discard(symbol)
+        denylist = self.strategy_denylists.get(strategy_id)
+        if denylist is not None:
+            denylist.difference_update(symbols)
+            if not denylist:
+                del self.strategy_denylists[strategy_id]
+            self._allow_cache.clear()
+    
+    def _get_candidate_symbols(self, account_id: str = None) -> FrozenSet[str]:
+        """
+        Format-valid symbols available to an account, or to any account when account_id is None
+        """
+        if account_id:
+            # If account is specified, get symbols for that account
+            self.fetch_available_symbols(account_id)
+            return self._valid_symbols[account_id]
+        
+        # Otherwise, get symbols from all exchanges
+        if self._all_symbols is None:
+            self._all_symbols = frozenset().union(*self._valid_symbols.values())
+        return self._all_symbols
     
     def get_filtered_symbols_for_strategy(self, strategy_id: str, account_id: str = None) -> List[str]:
         """
         Get all symbols that are allowed for a specific strategy
         """
         # Start with all available symbols
-        all_symbols = set()
-        if account_id:
-            # If account is specified, get symbols for that account
-            account_symbols = self.fetch_available_symbols(account_id)
-            all_symbols.update(account_symbols)
-        else:
-            # Otherwise, get symbols from all exchanges
-            for cache_key, symbols in self.available_symbols.items():
-                all_symbols.update(symbols)
+        all_symbols = self._get_candidate_symbols(account_id)
         
-        # Filter based on strategy allowlist/denylist
-        filtered_symbols = []
-        for symbol in all_symbols:
-            if self.is_symbol_allowed_for_strategy(symbol, strategy_id, account_id):
-                filtered_symbols.append(symbol)
+        # Filter based on strategy allowlist/denylist with set operations; format validity
+        # was already applied when the symbols were fetched
+        filtered_symbols = all_symbols
+        allowlist = self.strategy_allowlists.get(strategy_id)
+        if allowlist:
+            filtered_symbols = filtered_symbols & allowlist
+        denylist = self.strategy_denylists.get(strategy_id)
+        if denylist:
+            filtered_symbols = filtered_symbols - denylist
         
-        return filtered_symbols
+        # If account_id is provided, also apply account-specific filters
+        if account_id:
+            from account_config import account_config_manager
+            filtered_symbols = account_config_manager.filter_allowed_symbols(account_id, filtered_symbols)
+        
+        return list(filtered_symbols)
     
     def refresh_all_symbols(self):
         """
@@ -186,7 +262,8 @@ class SymbolManager:
         """
         Get metadata for a specific symbol
         """
-        return self.symbol_metadata.get(symbol)
+        metadata = self.symbol_metadata.get(symbol)
+        return asdict(metadata) if metadata is not None else None
     
     def get_symbols_with_filters(self, strategy_id: str, account_id: str = None, 
                                 min_volume: Optional[float] = None,
@@ -194,22 +271,38 @@ class SymbolManager:
         """
         Get symbols with additional filters like minimum volume
         """
-        symbols = self.get_filtered_symbols_for_strategy(strategy_id, account_id)
+        if min_volume is None and max_symbols is None:
+            return self.get_filtered_symbols_for_strategy(strategy_id, account_id)
         
-        # Apply volume filter if specified
-        if min_volume is not None:
-            filtered_by_volume = []
-            for symbol in symbols:
-                metadata = self.get_symbol_metadata(symbol)
-                if metadata and metadata.get('volume_24h', 0) >= min_volume:
-                    filtered_by_volume.append(symbol)
-            symbols = filtered_by_volume
+        symbols = self._iter_allowed_by_volume(strategy_id, account_id, min_volume)
         
-        # Limit number of symbols if specified
+        # Limit number of symbols if specified; the scan stops as soon as enough have qualified
         if max_symbols is not None:
-            symbols = symbols[:max_symbols]
+            symbols = islice(symbols, max_symbols)
         
-        return symbols
+        return list(symbols)
+    
+    def _iter_allowed_by_volume(self, strategy_id: str, account_id: str = None,
+                                min_volume: Optional[float] = None):
+        """
+        Yield allowed symbols from highest to lowest 24h volume, stopping below min_volume
+        """
+        # Fetch first: a cold account adds metadata, which resets the volume order built below
+        candidates = self._get_candidate_symbols(account_id)
+        
+        volume_symbols, volume_keys = self._volume_symbols, self._volume_keys
+        if volume_symbols is None:
+            by_volume = sorted(self.symbol_metadata.values(), key=lambda meta: meta.volume_24h, reverse=True)
+            volume_symbols = self._volume_symbols = [meta.symbol for meta in by_volume]
+            volume_keys = self._volume_keys = array('d', [-meta.volume_24h for meta in by_volume])
+        
+        # One binary search finds where volume drops below min_volume, instead of comparing every symbol;
+        # locals keep the scan on this snapshot even if a fetch resets the attributes meanwhile
+        stop = len(volume_symbols) if min_volume is None else bisect_right(volume_keys, -min_volume)
+        
+        for symbol in islice(volume_symbols, stop):
+            if symbol in candidates and self.is_symbol_allowed_for_strategy(symbol, strategy_id, account_id):
+                yield symbol
 
 
 # Global instance
@@ -5,148 +5,171 @@ It checks for positions that exist in the database but are closed on the exchang
 the database status accordingly.
 """
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, bindparam, select
 from sqlalchemy.orm import sessionmaker
 from models import Position
-from config import DATABASE_URL
+from config import DATABASE_URL, ENGINE_KWARGS
 from exchange_manager import exchange_manager
 import json
 import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime
 
-def sync_positions_with_exchange():
+log = logging.getLogger(__name__)
+
+# Database setup, shared by every sync run in this process
+engine = create_engine(DATABASE_URL, **ENGINE_KWARGS)
+SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+
+_positions = Position.__table__
+
+# Closes every position found flat on the exchange in one executemany; b_other is the
+# quantity with no recorded close reason, booked as "other". Rows closed since they were read are left alone
+_sync_close_stmt = (
+    _positions.update()
+    .where(_positions.c.id == bindparam('b_id'), _positions.c.status == 'OPEN')
+    .values(
+        status='CLOSED',
+        remaining_qty=0.0,
+        other_closed_qty=_positions.c.other_closed_qty + bindparam('b_other'),
+        updated_at=bindparam('b_updated_at'),
+    )
+)
+
+# Only the columns the sync reads, streamed in chunks instead of loading full Position objects;
+# the database sums every recorded close reason into total_closed
+_open_positions_stmt = (
+    select(
+        Position.id, Position.initial_qty,
+        (Position.closed_qty_tp1 + Position.closed_qty_tp2 + Position.closed_qty_tp3 +
+         Position.closed_qty_tp4 + Position.closed_qty_tp5 + Position.sl_closed_qty +
+         Position.timeguard_closed_qty + Position.maxbars_closed_qty +
+         Position.swingtp_closed_qty + Position.dyn_tp_closed_qty + Position.other_closed_qty).label('total_closed'),
+    )
+    .where(Position.status == 'OPEN')
+    .execution_options(yield_per=500)
+)
+
+def _mark_closed(pos, to_close, now):
+    """Queue a position row to be marked CLOSED in the end-of-sync batch"""
+    # If no specific close reason is recorded, mark as other closed
+    to_close.append({
+        'b_id': pos.id,
+        'b_other': max(pos.initial_qty - pos.total_closed, 0.0),
+        'b_updated_at': now,
+    })
+    log.debug("   ✅ Position %s queued to be CLOSED in database", pos.id)
+
+def _fetch_account_positions(account_id):
+    """Fetch an account's open exchange positions by symbol, or None if the request fails"""
+    try:
+        # One request returns every open position on the account
+        return exchange_manager.get_open_positions_by_symbol(account_id)
+    except Exception as e:
+        log.error("   ❌ Error fetching positions for account %s from exchange: %s", account_id, e)
+        return None
+
+def sync_positions_with_exchange(db=None, position_manager=None):
     """
     Synchronize positions between database and exchange
     Updates database positions that are closed on the exchange but still marked as OPEN in the database
+    Uses the given session if one is passed, otherwise opens (and closes) its own
+    With a PositionManager, the rows are closed under its per-position locks so the sync can't interleave
+    with a webhook or price monitor update of the same position
     """
-    print("🔄 Starting position synchronization...")
+    log.info("🔄 Starting position synchronization...")
     
-    # Create database session
-    engine = create_engine(DATABASE_URL)
-    SessionLocal = sessionmaker(bind=engine)
-    db = SessionLocal()
+    owns_session = db is None
+    if owns_session:
+        db = SessionLocal()
     
     try:
-        # Get all OPEN positions from the database
-        db_positions = db.query(Position).filter(Position.status == 'OPEN').all()
-        
-        if not db_positions:
-            print("✅ No open positions in database to synchronize")
-            return
+        to_close = []
+        now = datetime.utcnow()
         
-        print(f"🔍 Found {len(db_positions)} open positions in database to check...")
+        # Account IDs can contain underscores (e.g., ACC_A), so match known accounts as prefixes,
+        # longest first so ACC_A wins over ACC
+        account_prefixes = [(account_id, account_id + '_') for account_id in
+                            sorted(exchange_manager.get_account_ids(), key=len, reverse=True)]
         
-        synced_count = 0
-        
-        for pos in db_positions:
-            print(f"Checking position: {pos.id}")
-            
+        # Group positions by account so the exchange is queried once per account rather than once per position
+        by_account = {}
+        open_count = 0
+        for pos in db.execute(_open_positions_stmt):
+            open_count += 1
             # Extract account_id, symbol, and strategy_id from the position ID
             # Format: {account_id}_{symbol}_{strategy_id}
-            # Account ID can have underscores (e.g., ACC_A), so we need to find the right split point
-            pos_id_parts = pos.id.split('_')
-            
-            # The pattern is: account_id (could be ACC_A, ACC_B, etc.), symbol, strategy_id
-            # So we need to find where account ends and symbol starts
-            # Try different split points
             account_id = None
             symbol = None
             strategy_id = None
             
-            for i in range(1, len(pos_id_parts)):
-                potential_account = '_'.join(pos_id_parts[:i])
-                potential_symbol = pos_id_parts[i]
-                potential_strategy = '_'.join(pos_id_parts[i+1:])
-                
-                # Check if this account exists in exchange manager
-                try:
-                    exchange_manager.get_exchange_config(potential_account)
-                    # If no exception, this is a valid account
-                    account_id = potential_account
-                    symbol = potential_symbol
-                    strategy_id = potential_strategy
+            for candidate, prefix in account_prefixes:
+                if pos.id.startswith(prefix):
+                    account_id = candidate
+                    symbol, _, strategy_id = pos.id[len(prefix):].partition('_')
                     break
-                except:
-                    continue  # Try next split point
             
             if account_id and symbol and strategy_id:
-                
-                try:
-                    # Get current position info from exchange
-                    exchange_pos_info = exchange_manager.get_position_info(account_id, symbol)
-                    
-                    if exchange_pos_info is None:
-                        print(f"   📉 Position {pos.id} not found on exchange, marking as closed...")
-                        
-                        # Update the database position to CLOSED
-                        pos.status = 'CLOSED'
-                        pos.remaining_qty = 0.0
-                        pos.updated_at = datetime.utcnow()
-                        
-                        # Update other closed quantities if not already set
-                        total_closed = (pos.closed_qty_tp1 + pos.closed_qty_tp2 + pos.closed_qty_tp3 + 
-                                      pos.closed_qty_tp4 + pos.closed_qty_tp5 + pos.sl_closed_qty + 
-                                      pos.timeguard_closed_qty + pos.maxbars_closed_qty + 
-                                      pos.swingtp_closed_qty + pos.dyn_tp_closed_qty + pos.other_closed_qty)
-                        
-                        # If no specific close reason is recorded, mark as other closed
-                        if total_closed < pos.initial_qty:
-                            pos.other_closed_qty += (pos.initial_qty - total_closed)
-                        
-                        synced_count += 1
-                        print(f"   ✅ Updated position {pos.id} to CLOSED in database")
-                        continue
-                    
-                    # Check if there's an actual position on the exchange
-                    # For both Binance and Bybit, a position amount/size of 0 means no position
-                    position_amount_raw = exchange_pos_info.get('positionAmt') or exchange_pos_info.get('size', 0)
-                    
-                    # Handle potential empty strings or None values
-                    try:
-                        position_amount = float(position_amount_raw) if position_amount_raw != '' and position_amount_raw is not None else 0.0
-                    except (ValueError, TypeError):
-                        position_amount = 0.0
-                    
-                    if abs(position_amount) < 0.000001:  # Essentially zero position
-                        print(f"   📉 Position {pos.id} is closed on exchange but still OPEN in database. Updating...")
-                        
-                        # Update the database position to CLOSED
-                        pos.status = 'CLOSED'
-                        pos.remaining_qty = 0.0
-                        pos.updated_at = datetime.utcnow()
-                        
-                        # Update other closed quantities if not already set
-                        total_closed = (pos.closed_qty_tp1 + pos.closed_qty_tp2 + pos.closed_qty_tp3 + 
-                                      pos.closed_qty_tp4 + pos.closed_qty_tp5 + pos.sl_closed_qty + 
-                                      pos.timeguard_closed_qty + pos.maxbars_closed_qty + 
-                                      pos.swingtp_closed_qty + pos.dyn_tp_closed_qty + pos.other_closed_qty)
-                        
-                        # If no specific close reason is recorded, mark as other closed
-                        if total_closed < pos.initial_qty:
-                            pos.other_closed_qty += (pos.initial_qty - total_closed)
-                        
-                        synced_count += 1
-                        print(f"   ✅ Updated position {pos.id} to CLOSED in database")
-                    else:
-                        print(f"   ✅ Position {pos.id} is correctly OPEN on both exchange and database")
-                
-                except Exception as e:
-                    print(f"   ❌ Error checking position {pos.id} on exchange: {str(e)}")
-                    continue
+                by_account.setdefault(account_id, []).append((pos, symbol))
             else:
-                print(f"   ❌ Invalid position ID format: {pos.id}")
+                log.warning("   ❌ Invalid position ID format: %s", pos.id)
+        
+        if not open_count:
+            log.info("✅ No open positions in database to synchronize")
+            return
+        
+        log.info("🔍 Found %d open positions in database to check...", open_count)
+        
+        # The exchange requests are I/O bound, so fetch every account at once
+        if by_account:
+            with ThreadPoolExecutor(max_workers=min(len(by_account), 8)) as executor:
+                fetched = dict(zip(by_account, executor.map(_fetch_account_positions, by_account)))
+        else:
+            fetched = {}
+        
+        for account_id, account_positions in by_account.items():
+            exchange_positions = fetched[account_id]
+            if exchange_positions is None:
                 continue
+            
+            for pos, symbol in account_positions:
+                log.debug("Checking position: %s", pos.id)
+                exchange_pos_info = exchange_positions.get(symbol)
+                
+                if exchange_pos_info is None:
+                    log.info("   📉 Position %s not found on exchange, marking as closed...", pos.id)
+                    _mark_closed(pos, to_close, now)
+                    continue
+                
+                # Check if there's an actual position on the exchange
+                # For both Binance and Bybit, a position amount of 0 means no position
+                position_amount = exchange_pos_info.get('positionAmt') or 0.0
+                
+                if abs(position_amount) < 0.000001:  # Essentially zero position
+                    log.info("   📉 Position %s is closed on exchange but still OPEN in database. Updating...", pos.id)
+                    _mark_closed(pos, to_close, now)
+                else:
+                    log.debug("   ✅ Position %s is correctly OPEN on both exchange and database", pos.id)
         
-        # Commit all changes to the database
-        db.commit()
-        print(f"\n✅ Position synchronization completed!")
-        print(f"📊 Updated {synced_count} positions from OPEN to CLOSED")
+        # Write all closes in one statement and commit
+        with ExitStack() as locks:
+            if to_close:
+                if position_manager is not None:
+                    # Sorted, like PositionManager's own batches, so concurrent lockers can't deadlock
+                    for pos_id in sorted(row['b_id'] for row in to_close):
+                        locks.enter_context(position_manager.position_lock(pos_id))
+                db.execute(_sync_close_stmt, to_close)
+            db.commit()
+        log.info("✅ Position synchronization completed! 📊 Updated %d positions from OPEN to CLOSED", len(to_close))
         
     except Exception as e:
-        print(f"❌ Error during position synchronization: {str(e)}")
+        log.error("❌ Error during position synchronization: %s", e)
         db.rollback()
     finally:
-        db.close()
+        if owns_session:
+            db.close()
 
 def sync_and_display_status():
     """Sync positions and display current status"""
@@ -154,15 +177,13 @@ def sync_and_display_status():
     print("POSITION SYNCHRONIZATION AND STATUS CHECK")
     print("=" * 60)
     
-    # First, sync the positions
-    sync_positions_with_exchange()
-    
-    # Then show the current status
-    engine = create_engine(DATABASE_URL)
-    SessionLocal = sessionmaker(bind=engine)
     db = SessionLocal()
     
     try:
+        # First, sync the positions
+        sync_positions_with_exchange(db)
+        
+        # Then show the current status
         all_positions = db.query(Position).all()
         open_positions = [pos for pos in all_positions if pos.status == 'OPEN']
         closed_positions = [pos for pos in all_positions if pos.status == 'CLOSED']
@@ -189,4 +210,5 @@ def sync_and_display_status():
     print("=" * 60)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     sync_and_display_status()
\ No newline at end of file